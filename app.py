@@ -7,16 +7,24 @@ import subprocess
 import threading
 import time
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 import json
 
+# orjson is much faster than the stdlib for API responses and chat streaming; fall back if it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Import utility modules
-from utils.extract_text import extract_text_from_file, chunk_text
-from utils.embedding import generate_embeddings
+from utils.extract_text import extract_text_from_file, iter_chunks, sample_text
+from utils.embedding import generate_embeddings, quantize_embedding
 from utils.pinecone_manager import PineconeManager
-from utils.chat import generate_chat_response, generate_streaming_chat_response, generate_tags, generate_comprehensive_metadata
+from utils.chat import generate_chat_response, generate_streaming_chat_response, generate_tags, generate_comprehensive_metadata, generate_comprehensive_metadata_batch
 import utils.embedding as embedding_module
 import utils.chat as chat_module
+import utils.openai_client as openai_client
 
 # Import folder processor
 import folder_processor
@@ -26,8 +34,29 @@ from collections import defaultdict
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes jsonify() responses with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            # orjson is stricter (e.g. integers beyond 64 bits); let the stdlib handle those
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def sse_event(data):
+    """Format data as a server-sent event"""
+    if orjson is not None:
+        return b"data: " + orjson.dumps(data) + b"\n\n"
+    return f"data: {json.dumps(data)}\n\n"
+
 # Initialize Flask app
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 
 # Configuration
@@ -53,7 +82,8 @@ if pinecone_available:
     try:
         pinecone_manager = PineconeManager(
             api_key=PINECONE_API_KEY,
-            environment=PINECONE_ENV
+            environment=PINECONE_ENV,
+            dimension=embedding_module.EMBEDDING_DIMENSIONS
         )
         logger.info("Pinecone initialized successfully")
     except Exception as e:
@@ -62,8 +92,8 @@ if pinecone_available:
 
 # Initialize OpenAI clients if API key is available
 if openai_available and OPENAI_API_KEY:
-    embedding_module.client = embedding_module.OpenAI(api_key=OPENAI_API_KEY)
-    chat_module.client = chat_module.OpenAI(api_key=OPENAI_API_KEY)
+    # Embedding and chat calls share one client and connection pool
+    embedding_module.client = chat_module.client = openai_client.get_client(OPENAI_API_KEY)
     logger.info("OpenAI clients initialized successfully")
 
 # Helper functions
@@ -120,12 +150,20 @@ def upload_file():
         failed_files = []
         all_ai_tags = set()  # To collect all AI tags across files
         
+        # Save and extract every file first, so metadata for all of them can be
+        # generated with one batched request. Only each file's sample is kept; the
+        # full text is extracted again when the file is chunked, so memory holds one
+        # document at a time rather than all of them.
+        extracted_files = []
         for file in files:
+            # Reset per file so the cleanup below never removes the previous file
+            filepath = None
             try:
                 # Generate a unique filename
                 orig_filename = secure_filename(file.filename)
                 file_ext = orig_filename.rsplit('.', 1)[1].lower()
-                unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
+                doc_uuid = uuid.uuid4().hex  # Also prefixes this file's chunk ids
+                unique_filename = f"{doc_uuid}.{file_ext}"
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
                 
                 # Save file to temp directory
@@ -139,30 +177,58 @@ def upload_file():
                     os.remove(filepath)
                     continue
                 
-                # Generate comprehensive metadata if OpenAI is available
-                file_ai_tags = []
-                file_metadata = {}
-                if openai_available:
-                    try:
-                        # Use the first chunk or a portion of text for metadata generation
-                        sample_text = extracted_text[:20000]  # Use first 20k chars for metadata generation
-                        file_metadata = generate_comprehensive_metadata(
-                            text=sample_text, 
-                            filename=orig_filename,
-                            file_ext=file_ext,
-                            max_tags=10
-                        )
-                        
-                        # Get the general tags for backward compatibility
-                        file_ai_tags = file_metadata.get("general_tags", [])
-                        logger.debug(f"Generated {len(file_ai_tags)} AI tags for {orig_filename}: {file_ai_tags}")
-                        all_ai_tags.update(file_ai_tags)  # Add to the set of all tags
-                        
-                        # Log summary of generated metadata
-                        logger.debug(f"Generated metadata for {orig_filename} with {len(file_metadata)} categories")
-                    except Exception as tag_error:
-                        logger.error(f"Error generating metadata for {orig_filename}: {tag_error}")
-                        # Continue even if metadata generation fails
+                extracted_files.append({
+                    'filename': orig_filename,
+                    'file_ext': file_ext,
+                    'doc_uuid': doc_uuid,
+                    'filepath': filepath,
+                    'sample': sample_text(extracted_text)  # Strided sample from across the document
+                })
+                del extracted_text
+                
+            except Exception as file_error:
+                logger.error(f"Error processing file {file.filename}: {file_error}")
+                failed_files.append(f"{file.filename} ({str(file_error)})")
+                # Try to clean up temp file if it exists
+                try:
+                    if filepath and os.path.exists(filepath):
+                        os.remove(filepath)
+                except:
+                    pass
+        
+        # Generate comprehensive metadata for all files in one batched request if OpenAI is available
+        metadata_results = [{} for _ in extracted_files]
+        if openai_available and extracted_files:
+            try:
+                metadata_results = generate_comprehensive_metadata_batch(
+                    [{
+                        'text': extracted['sample'],
+                        'filename': extracted['filename'],
+                        'file_ext': extracted['file_ext']
+                    } for extracted in extracted_files],
+                    max_tags=10
+                )
+            except Exception as tag_error:
+                logger.error(f"Error generating metadata: {tag_error}")
+                # Continue even if metadata generation fails
+        
+        for extracted, file_metadata in zip(extracted_files, metadata_results):
+            orig_filename = extracted['filename']
+            file_ext = extracted['file_ext']
+            doc_uuid = extracted['doc_uuid']
+            filepath = extracted['filepath']
+            try:
+                extracted_text = extract_text_from_file(filepath, file_ext)
+                if not extracted_text:
+                    raise ValueError("unable to extract text")
+                
+                # Get the general tags for backward compatibility
+                file_ai_tags = file_metadata.get("general_tags", [])
+                logger.debug(f"Generated {len(file_ai_tags)} AI tags for {orig_filename}: {file_ai_tags}")
+                all_ai_tags.update(file_ai_tags)  # Add to the set of all tags
+                
+                # Log summary of generated metadata
+                logger.debug(f"Generated metadata for {orig_filename} with {len(file_metadata)} categories")
                 
                 # Combine manual and AI tags for this file, removing duplicates
                 file_tags_list = manual_tags_list.copy()
@@ -170,57 +236,53 @@ def upload_file():
                     if ai_tag.lower() not in [tag.lower() for tag in file_tags_list]:
                         file_tags_list.append(ai_tag)
                 
-                # Chunk the text
-                chunks = chunk_text(extracted_text)
-                logger.debug(f"Created {len(chunks)} chunks from {orig_filename}")
+                # Small, filterable fields are kept on every chunk; the full file
+                # metadata is stored once under the document id
+                chunk_metadata_base = {
+                    'filename': orig_filename,
+                    'doc_id': doc_uuid,
+                    'filetype': file_ext,
+                    'subject': (file_metadata or {}).get('subject', subject),  # Use AI-generated subject if available
+                    'tags': file_tags_list,
+                    'source': 'user_upload',
+                    'user_id': session.get('user_id', 'anonymous')
+                }
+                shared_metadata = {k: v for k, v in (file_metadata or {}).items() if k != 'general_tags'}
+                pinecone_manager.upsert_document(doc_uuid, {**shared_metadata, **chunk_metadata_base})
+                
+                # Chunk the text lazily; the chunker keeps only the tokens, so the
+                # extracted text can be freed once chunking starts
+                chunks = iter_chunks(extracted_text)
+                del extracted_text
                 
-                # Process each chunk with improved timeout handling
+                # Embed each batch of chunks with one API request and upsert it together
                 chunk_count = 0
-                batch_size = 3  # Process chunks in smaller batches to avoid timeouts
+                batch_size = folder_processor.BATCH_SIZE
                 
-                for i in range(0, len(chunks), batch_size):
-                    batch = chunks[i:i+batch_size]
+                # Several batches are embedded concurrently; each falls back to
+                # per-chunk requests if its batch request is rejected
+                batches = enumerate(folder_processor.batched(chunks, batch_size))
+                for i, batch, embeddings, errors, _ in folder_processor.embed_batches(batches):
+                    for error in errors:
+                        # Log the error but continue with the other chunks
+                        logger.error(f"Error processing {error} from {orig_filename}")
                     
-                    for j, chunk in enumerate(batch):
-                        chunk_index = i + j
-                        try:
-                            # Generate embeddings with shorter timeout
-                            embedding = generate_embeddings(chunk, max_retries=2)  # Reduced retries for faster feedback
-                            
-                            # Start with basic metadata
-                            metadata = {
-                                'text': chunk,
-                                'filename': orig_filename,
-                                'filetype': file_ext,
-                                'subject': file_metadata.get('subject', subject),  # Use AI-generated subject if available
-                                'tags': file_tags_list,
-                                'chunk_id': chunk_index,
-                                'source': 'user_upload',
-                                'user_id': session.get('user_id', 'anonymous')
-                            }
-                            
-                            # Add comprehensive AI-generated metadata if available
-                            if file_metadata:
-                                # Add all detailed metadata fields
-                                for key, value in file_metadata.items():
-                                    if key != 'general_tags':  # Skip general tags as they're already in the tags field
-                                        metadata[key] = value
-                            
-                            # Proceed only if we have valid embeddings
-                            if embedding and len(embedding) > 0:
-                                pinecone_manager.upsert(
-                                    id=f"{uuid.uuid4()}",
-                                    vector=embedding,
-                                    metadata=metadata
-                                )
-                                chunk_count += 1
-                            else:
-                                logger.warning(f"Empty embedding for chunk {chunk_index} of {orig_filename}")
-                                
-                        except Exception as chunk_error:
-                            # Log the error but continue with the next chunk
-                            logger.error(f"Error processing chunk {chunk_index} from {orig_filename}: {chunk_error}")
-                            # Consider if not counting failed chunks is appropriate for your UI
+                    items = []
+                    for j, (chunk, embedding) in enumerate(zip(batch, embeddings)):
+                        chunk_index = i * batch_size + j
+                        
+                        # Proceed only if we have valid embeddings
+                        if embedding and len(embedding) > 0:
+                            items.append((
+                                f"{doc_uuid}_{chunk_index:06d}",
+                                quantize_embedding(embedding),
+                                {**chunk_metadata_base, 'text': chunk, 'chunk_id': chunk_index}
+                            ))
+                        elif embedding is not None:
+                            logger.warning(f"Empty embedding for chunk {chunk_index} of {orig_filename}")
+                    
+                    if items:
+                        chunk_count += pinecone_manager.upsert_many(items)
                 
                 # Clean up temp file
                 os.remove(filepath)
@@ -233,11 +295,11 @@ def upload_file():
                 })
                 
             except Exception as file_error:
-                logger.error(f"Error processing file {file.filename}: {file_error}")
-                failed_files.append(f"{file.filename} ({str(file_error)})")
+                logger.error(f"Error processing file {orig_filename}: {file_error}")
+                failed_files.append(f"{orig_filename} ({str(file_error)})")
                 # Try to clean up temp file if it exists
                 try:
-                    if 'filepath' in locals() and os.path.exists(filepath):
+                    if os.path.exists(filepath):
                         os.remove(filepath)
                 except:
                     pass
@@ -316,7 +378,8 @@ def chat():
             results = pinecone_manager.query(
                 vector=query_embedding,
                 top_k=5,
-                include_metadata=True
+                include_metadata=True,
+                resolve_documents=True
             )
         except Exception as query_error:
             logger.error(f"Error querying Pinecone: {query_error}")
@@ -327,7 +390,7 @@ def chat():
             }), 500
         
         # Generate response using OpenAI
-        response = generate_chat_response(query, results, max_retries=2)
+        response = generate_chat_response(query, results, max_retries=2, query_embedding=query_embedding)
         
         return jsonify(response)
         
@@ -384,7 +447,8 @@ def chat_stream():
             results = pinecone_manager.query(
                 vector=query_embedding,
                 top_k=5,
-                include_metadata=True
+                include_metadata=True,
+                resolve_documents=True
             )
         except Exception as query_error:
             logger.error(f"Error querying Pinecone: {query_error}")
@@ -396,8 +460,8 @@ def chat_stream():
         
         # Generate streaming response
         def generate():
-            for chunk in generate_streaming_chat_response(query, results):
-                yield f"data: {json.dumps(chunk)}\n\n"
+            for chunk in generate_streaming_chat_response(query, results, query_embedding=query_embedding):
+                yield sse_event(chunk)
                 
         return Response(stream_with_context(generate()), mimetype='text/event-stream')
     except Exception as e:
@@ -442,7 +506,8 @@ def upload_progress():
         # Generate a unique filename
         orig_filename = secure_filename(file.filename)
         file_ext = orig_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
+        doc_uuid = uuid.uuid4().hex  # Also prefixes this file's chunk ids
+        unique_filename = f"{doc_uuid}.{file_ext}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         
         # Save file
@@ -468,9 +533,9 @@ def upload_progress():
         file_metadata = {}
         if openai_available:
             try:
-                sample_text = extracted_text[:20000]  # Use first 20k chars for metadata generation
+                metadata_sample = sample_text(extracted_text)  # Strided sample from across the document
                 file_metadata = generate_comprehensive_metadata(
-                    text=sample_text,
+                    text=metadata_sample,
                     filename=orig_filename,
                     file_ext=file_ext,
                     max_tags=10
@@ -492,78 +557,59 @@ def upload_progress():
             if ai_tag.lower() not in [tag.lower() for tag in tags_list]:
                 tags_list.append(ai_tag)
         
-        # Chunk the text
-        chunks = chunk_text(extracted_text)
-        total_chunks = len(chunks)
+        # Small, filterable fields are kept on every chunk; the full file
+        # metadata is stored once under the document id
+        chunk_metadata_base = {
+            'filename': orig_filename,
+            'doc_id': doc_uuid,
+            'filetype': file_ext,
+            'subject': (file_metadata or {}).get('subject', subject),  # Use AI-generated subject if available
+            'tags': tags_list,
+            'source': 'user_upload',
+            'user_id': session.get('user_id', 'anonymous')
+        }
+        shared_metadata = {k: v for k, v in (file_metadata or {}).items() if k != 'general_tags'}
+        pinecone_manager.upsert_document(doc_uuid, {**shared_metadata, **chunk_metadata_base})
         
-        # Process in smaller batches to avoid timeouts
-        processed_chunks = 0
-        batch_size = 3  # Smaller batches to avoid timeouts
+        # Chunk the text lazily and estimate the chunk count for progress until
+        # the real count is known; the extracted text can be freed once chunking starts
+        total_chunks = max(1, len(extracted_text) // folder_processor.CHARS_PER_CHUNK_ESTIMATE)
+        chunks = iter_chunks(extracted_text)
+        del extracted_text
         
-        for i in range(0, total_chunks, batch_size):
-            batch = chunks[i:i+batch_size]
-            batch_embeddings = []
-            batch_metadata = []
-            batch_ids = []
+        # Embed each batch of chunks with one API request
+        processed_chunks = 0
+        chunks_seen = 0
+        batch_size = folder_processor.BATCH_SIZE
+        
+        # Several batches are embedded concurrently; each falls back to
+        # per-chunk requests if its batch request is rejected
+        batches = enumerate(folder_processor.batched(chunks, batch_size))
+        for i, batch, embeddings, errors, _ in folder_processor.embed_batches(batches):
+            chunks_seen += len(batch)
+            for error in errors:
+                logger.error(f"Error processing {error}")
+                # Continue with other chunks
             
-            # Generate embeddings for the batch
-            for j, chunk in enumerate(batch):
-                chunk_index = i + j
-                try:
-                    # Generate embeddings with reduced retries for faster feedback
-                    embedding = generate_embeddings(chunk, max_retries=1)
-                    
-                    if embedding and len(embedding) > 0:
-                        # Create metadata
-                        metadata = {
-                            'text': chunk,
-                            'filename': orig_filename,
-                            'filetype': file_ext,
-                            'subject': file_metadata.get('subject', subject),  # Use AI-generated subject if available
-                            'tags': tags_list,
-                            'chunk_id': chunk_index,
-                            'source': 'user_upload',
-                            'user_id': session.get('user_id', 'anonymous')
-                        }
-                        
-                        # Add comprehensive AI-generated metadata if available
-                        if file_metadata:
-                            # Add all detailed metadata fields
-                            for key, value in file_metadata.items():
-                                if key != 'general_tags':  # Skip general tags as they're already in the tags field
-                                    metadata[key] = value
-                                    
-                        # Add to batch for upserting
-                        batch_embeddings.append(embedding)
-                        batch_metadata.append(metadata)
-                        batch_ids.append(f"{uuid.uuid4()}")
-                
-                except Exception as e:
-                    logger.error(f"Error processing chunk {chunk_index}: {e}")
-                    # Continue with other chunks
+            items = []
+            for j, (chunk, embedding) in enumerate(zip(batch, embeddings)):
+                chunk_index = i * batch_size + j
+                if embedding and len(embedding) > 0:
+                    items.append((
+                        f"{doc_uuid}_{chunk_index:06d}",
+                        quantize_embedding(embedding),
+                        {**chunk_metadata_base, 'text': chunk, 'chunk_id': chunk_index}
+                    ))
             
-            # Upsert the batch to Pinecone
-            if batch_embeddings:
-                try:
-                    # Format for Pinecone batch upsert
-                    vectors = []
-                    for k in range(len(batch_embeddings)):
-                        vectors.append({
-                            "id": batch_ids[k],
-                            "values": batch_embeddings[k],
-                            "metadata": batch_metadata[k]
-                        })
-                    
-                    # Batch upsert to Pinecone
-                    if pinecone_manager.index:
-                        pinecone_manager.index.upsert(vectors=vectors, namespace="default")
-                        processed_chunks += len(vectors)
-                        
-                except Exception as batch_error:
-                    logger.error(f"Error upserting batch to Pinecone: {batch_error}")
+            # Batch upsert to Pinecone, split to fit the request size limit
+            if items:
+                processed_chunks += pinecone_manager.upsert_many(items)
             
             # Update progress
-            progress = int((processed_chunks / total_chunks) * 100) if total_chunks > 0 else 100
+            progress = int((processed_chunks / max(total_chunks, chunks_seen)) * 100)
+        
+        # The chunk stream is exhausted, so the real count is known now
+        total_chunks = chunks_seen
         
         # Clean up temp file
         os.remove(filepath)
@@ -729,64 +775,62 @@ def list_complete_files_in_pinecone():
         # Get files from processed folder as a source of truth for completed files
         processed_files = {}
         if os.path.exists(folder_processor.PROCESSED_FOLDER):
-            for filename in os.listdir(folder_processor.PROCESSED_FOLDER):
-                if os.path.isfile(os.path.join(folder_processor.PROCESSED_FOLDER, filename)) and folder_processor.allowed_file(filename):
-                    # Get the file extension
-                    file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-                    
-                    # Get chunk count from Pinecone (safe, limited query)
-                    chunk_count = get_chunk_count_for_file(filename)
-                    
-                    processed_files[filename] = {
-                        "total_chunks": chunk_count,
-                        "filetype": file_ext,
-                        "subjects": [],
-                        "tags": [],
-                        "status": "Complete"
-                    }
+            for filename in folder_processor.list_allowed_files(folder_processor.PROCESSED_FOLDER):
+                # Get the file extension
+                file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+                
+                # Get chunk count from Pinecone (safe, limited query)
+                chunk_count = get_chunk_count_for_file(filename)
+                
+                processed_files[filename] = {
+                    "total_chunks": chunk_count,
+                    "filetype": file_ext,
+                    "subjects": [],
+                    "tags": [],
+                    "status": "Complete"
+                }
         
         # Get files from upload folder to detect incomplete files
         upload_files = {}
         incomplete_files = {}
         if os.path.exists(folder_processor.UPLOAD_FOLDER):
-            for filename in os.listdir(folder_processor.UPLOAD_FOLDER):
-                filepath = os.path.join(folder_processor.UPLOAD_FOLDER, filename)
-                if os.path.isfile(filepath) and folder_processor.allowed_file(filename):
-                    # Only add to incomplete files if not already in processed files
-                    if filename not in processed_files:
-                        file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-                        file_size = os.path.getsize(filepath)
-                        
-                        # Get processing status if available
-                        status_data = folder_processor.load_status()
-                        file_status = status_data.get(filename, {})
-                        current_status = file_status.get('status', 'pending')
-                        progress = file_status.get('progress', 0)
-                        
-                        # Format file size
-                        size_str = ""
-                        if file_size < 1024:
-                            size_str = f"{file_size} bytes"
-                        elif file_size < 1024 * 1024:
-                            size_str = f"{file_size / 1024:.1f} KB"
-                        else:
-                            size_str = f"{file_size / (1024 * 1024):.1f} MB"
-                        
-                        incomplete_files[filename] = {
-                            "filetype": file_ext,
-                            "status": "Pending Processing" if current_status == 'pending' else 
-                                     "Processing" if current_status == 'processing' else
-                                     "Error" if current_status == 'error' else "Incomplete",
-                            "progress": progress,
-                            "size": size_str,
-                            "completeness": f"{progress}%",
-                            "file_path": "upload_folder"
-                        }
+            status_data = folder_processor.load_status()
+            for entry in folder_processor.scan_allowed_files(folder_processor.UPLOAD_FOLDER):
+                filename = entry.name
+                # Only add to incomplete files if not already in processed files
+                if filename not in processed_files:
+                    file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+                    file_size = entry.stat(follow_symlinks=False).st_size
+                    
+                    # Get processing status if available
+                    file_status = status_data.get(filename, {})
+                    current_status = file_status.get('status', 'pending')
+                    progress = file_status.get('progress', 0)
+                    
+                    # Format file size
+                    size_str = ""
+                    if file_size < 1024:
+                        size_str = f"{file_size} bytes"
+                    elif file_size < 1024 * 1024:
+                        size_str = f"{file_size / 1024:.1f} KB"
                     else:
-                        # File is already processed but still in upload folder
-                        upload_files[filename] = processed_files[filename]
-                        upload_files[filename]["status"] = "Ready for Removal"
-                        upload_files[filename]["note"] = "File is already processed but still in upload folder"
+                        size_str = f"{file_size / (1024 * 1024):.1f} MB"
+                    
+                    incomplete_files[filename] = {
+                        "filetype": file_ext,
+                        "status": "Pending Processing" if current_status == 'pending' else 
+                                 "Processing" if current_status == 'processing' else
+                                 "Error" if current_status == 'error' else "Incomplete",
+                        "progress": progress,
+                        "size": size_str,
+                        "completeness": f"{progress}%",
+                        "file_path": "upload_folder"
+                    }
+                else:
+                    # File is already processed but still in upload folder
+                    upload_files[filename] = processed_files[filename]
+                    upload_files[filename]["status"] = "Ready for Removal"
+                    upload_files[filename]["note"] = "File is already processed but still in upload folder"
         
         # Process the incomplete files based on status data
         # This enhances the information with progress data
@@ -858,18 +902,12 @@ def api_upload_status():
         # Get files from upload folder
         pending_files = []
         if os.path.exists(folder_processor.UPLOAD_FOLDER):
-            for filename in os.listdir(folder_processor.UPLOAD_FOLDER):
-                filepath = os.path.join(folder_processor.UPLOAD_FOLDER, filename)
-                if os.path.isfile(filepath) and folder_processor.allowed_file(filename):
-                    pending_files.append(filename)
+            pending_files = folder_processor.list_allowed_files(folder_processor.UPLOAD_FOLDER)
         
         # Get files from processed folder
         processed_files = []
         if os.path.exists(folder_processor.PROCESSED_FOLDER):
-            for filename in os.listdir(folder_processor.PROCESSED_FOLDER):
-                filepath = os.path.join(folder_processor.PROCESSED_FOLDER, filename)
-                if os.path.isfile(filepath) and folder_processor.allowed_file(filename):
-                    processed_files.append(filename)
+            processed_files = folder_processor.list_allowed_files(folder_processor.PROCESSED_FOLDER)
         
         # Get processing status
         processing_status = folder_processor.load_status()
@@ -1196,10 +1234,7 @@ def remove_complete_files():
         # Get the list of files in the upload folder
         pending_files = []
         if os.path.exists(folder_processor.UPLOAD_FOLDER):
-            for filename in os.listdir(folder_processor.UPLOAD_FOLDER):
-                filepath = os.path.join(folder_processor.UPLOAD_FOLDER, filename)
-                if os.path.isfile(filepath) and folder_processor.allowed_file(filename):
-                    pending_files.append(filename)
+            pending_files = folder_processor.list_allowed_files(folder_processor.UPLOAD_FOLDER)
                     
         # Find files that are both in the upload folder and complete in Pinecone
         removable_files = set(pending_files).intersection(complete_filenames)
@@ -15,16 +15,39 @@ Features:
 import os
 import time
 import shutil
+import atexit
 import logging
 import uuid
 import json
+import queue
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from itertools import chain, islice
 from datetime import datetime
 from flask import flash
 
+# watchdog delivers filesystem events so new uploads are picked up without polling
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+# orjson is much faster than the stdlib for the status file; fall back if it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Import utility modules
-from utils.extract_text import extract_text_from_file, chunk_text
-from utils.embedding import generate_embeddings
-from utils.pinecone_manager import PineconeManager
+from utils.extract_text import (
+    extract_text_from_file, iter_chunks, iter_pdf_chunks, open_pdf_stream, sample_text, should_stream_pdf
+)
+from utils.embedding import generate_embeddings, generate_embeddings_batch, quantize_embedding
+from utils.pinecone_manager import PineconeManager, pack_vectors
 from utils.chat import generate_comprehensive_metadata
 
 # Initialize logging
@@ -36,17 +59,46 @@ logger = logging.getLogger('folder_processor')
 UPLOAD_FOLDER = "upload_folder"
 PROCESSED_FOLDER = "processed_folder"
 ALLOWED_EXTENSIONS = {'pdf', 'epub', 'txt', 'mobi', 'azw', 'azw3'}
-BATCH_SIZE = 5  # Process this many chunks at once
+ALLOWED_SUFFIXES = tuple('.' + ext for ext in ALLOWED_EXTENSIONS)
+BATCH_SIZE = 64  # Chunks per embedding request and Pinecone upsert
+CHARS_PER_CHUNK_ESTIMATE = 2000  # ~500 tokens per chunk, used for progress before chunking finishes
+PIPELINE_QUEUE_SIZE = 4  # Batches each pipeline stage may run ahead of the next
+
+# Files processed at the same time; the work is mostly waiting on OpenAI and Pinecone
+PROCESSOR_CONCURRENCY = int(os.environ.get("PROCESSOR_CONCURRENCY", 5))
+
+# Embedding requests in flight at once, across all files; the shared rate limiter
+# still paces them, so this only bounds how many wait on the network together
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", 8))
+
+# Processes for text extraction; PDF/EPUB parsing is CPU-bound and would otherwise hold the GIL
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1))
+
+# "watch" uses filesystem events when watchdog is available, "poll" rescans every 5 seconds
+FOLDER_WATCH_MODE = os.environ.get("FOLDER_WATCH_MODE", "watch").lower()
+WATCH_RESCAN_INTERVAL = 60  # Seconds between rescans in watch mode, to retry failed or stuck files
 
 # Status file to track progress
 STATUS_FILE = "processing_status.json"
+# Copy of the status written atomically on every fsynced flush (terminal statuses and
+# exit). The status file itself is rewritten in place, so a crash mid-write can leave
+# it unreadable; the snapshot then still knows which files were already processed.
+STATUS_SNAPSHOT_FILE = f"{STATUS_FILE}.snapshot"
+
+# Per-file logs hold the full message history; the status file keeps only the tail
+LOG_FOLDER = "logs"
+MAX_STATUS_MESSAGES = 50
+
+# Seconds to wait after a status change before writing the status file
+STATUS_FLUSH_INTERVAL = 1.0
 
 # Initialize API clients
 import os
 from utils.pinecone_manager import PineconeManager
 import utils.embedding as embedding_module
 import utils.chat as chat_module
-from openai import OpenAI
+import utils.openai_client as openai_client
+from openai import OpenAI, BadRequestError
 
 # Check for API keys and initialize services
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -63,7 +115,8 @@ if pinecone_available:
     try:
         pinecone_manager = PineconeManager(
             api_key=PINECONE_API_KEY,
-            environment=PINECONE_ENV
+            environment=PINECONE_ENV,
+            dimension=embedding_module.EMBEDDING_DIMENSIONS
         )
         logger.info("Pinecone initialized successfully")
     except Exception as e:
@@ -72,8 +125,8 @@ if pinecone_available:
 
 # Initialize OpenAI clients if API key is available
 if openai_available and OPENAI_API_KEY:
-    embedding_module.client = embedding_module.OpenAI(api_key=OPENAI_API_KEY)
-    chat_module.client = chat_module.OpenAI(api_key=OPENAI_API_KEY)
+    # Embedding and chat calls share one client and connection pool
+    embedding_module.client = chat_module.client = openai_client.get_client(OPENAI_API_KEY)
     logger.info("OpenAI clients initialized successfully")
 
 
@@ -82,124 +135,489 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def load_status():
-    """Load processing status from the status file"""
+def batched(iterable, size):
+    """Yield lists of up to `size` items from an iterable without materializing it"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def prefetch(iterable, maxsize=PIPELINE_QUEUE_SIZE):
+    """
+    Consume an iterable in a background thread, buffering up to maxsize items
+    
+    This lets one pipeline stage (chunking, embedding) run ahead of the stage
+    consuming it. Exceptions raised by the iterable are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+    
+    def put(item):
+        # Give up if the consumer has gone away, rather than blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((done, e))
+            return
+        put((done, None))
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def embed_batch(batch, first_index=0):
+    """
+    Embed a batch of chunks with one API request, falling back to per-chunk
+    requests if the batch is rejected
+    
+    Returns:
+        tuple: (embeddings aligned with batch, None for failed chunks,
+                list of error messages, first exception or None)
+    """
+    try:
+        return generate_embeddings_batch(batch, max_retries=2), [], None
+    except BadRequestError as e:
+        # Usually one oversized input - embed chunks individually so the rest still succeed
+        logger.warning(f"Batch embedding request rejected, falling back to per-chunk requests: {e}")
+    except Exception as e:
+        return [None] * len(batch), [f"chunk {first_index + j}: {e}" for j in range(len(batch))], e
+    
+    embeddings, errors, first_error = [], [], None
+    for j, chunk in enumerate(batch):
+        try:
+            embeddings.append(generate_embeddings(chunk, max_retries=2))
+        except Exception as e:
+            embeddings.append(None)
+            errors.append(f"chunk {first_index + j}: {e}")
+            if first_error is None:
+                first_error = e
+    return embeddings, errors, first_error
+
+
+def embed_batches(batches):
+    """
+    Embed (batch_number, batch) pairs with several requests in flight at once
+    
+    Up to EMBED_CONCURRENCY batches are submitted ahead of the consumer, so the
+    latency of N batches is close to the slowest one rather than their sum.
+    
+    Yields:
+        tuple: (batch_number, batch, embeddings, errors, first exception), in input order
+    """
+    pending = deque()
+    for batch_number, batch in batches:
+        pending.append((batch_number, batch, embed_executor.submit(embed_batch, batch, batch_number * BATCH_SIZE)))
+        if len(pending) >= EMBED_CONCURRENCY:
+            batch_number, batch, future = pending.popleft()
+            yield (batch_number, batch, *future.result())
+    while pending:
+        batch_number, batch, future = pending.popleft()
+        yield (batch_number, batch, *future.result())
+
+
+def chunk_progress(done, total):
+    """Map chunk progress onto the 40-90% band of the overall file progress"""
+    return 40 + min(done, total) * 50 // total if total else 40
+
+
+def scan_allowed_files(folder):
+    """
+    Return DirEntry objects for supported document files in a folder
+    
+    Uses a single directory scan; the file-type check comes from the directory
+    entry itself, so no per-file stat call is needed.
+    """
+    with os.scandir(folder) as entries:
+        return [entry for entry in entries
+                if entry.is_file(follow_symlinks=False) and entry.name.lower().endswith(ALLOWED_SUFFIXES)]
+
+
+def list_allowed_files(folder):
+    """List names of supported document files in a folder"""
+    return [entry.name for entry in scan_allowed_files(folder)]
+
+
+_same_device = None
+
+
+def move_to_processed(filepath, processed_path):
+    """
+    Move a finished file into the processed folder
+    
+    When both folders are on the same filesystem (checked once and cached) this
+    is a single atomic rename; otherwise shutil.move copies and deletes.
+    """
+    global _same_device
+    if _same_device is None:
+        try:
+            _same_device = os.stat(UPLOAD_FOLDER).st_dev == os.stat(PROCESSED_FOLDER).st_dev
+        except OSError:
+            _same_device = False
+    
+    if _same_device:
+        try:
+            os.replace(filepath, processed_path)
+            return
+        except OSError as e:
+            logger.warning(f"Rename into processed folder failed ({e}), falling back to copy")
+    shutil.move(filepath, processed_path)
+
+
+_file_loggers = {}
+_file_loggers_lock = threading.Lock()
+
+# Processing status is kept in memory and flushed to STATUS_FILE in the background.
+# The web app and a standalone `python folder_processor.py` can share the file, so it
+# is read back whenever another process has changed it (see _get_status_cache).
+_status_lock = threading.RLock()
+_status_cache = None
+_status_dirty = False
+_status_mtime = None  # STATUS_FILE's mtime as of this process's last read or write
+_dirty_files = set()  # Files whose entries this process changed since the last flush
+_status_replaced = False  # save_status replaced the whole status since the last flush
+_flush_timer = None
+_status_fh = None
+_last_progress = {}  # filename -> (status, progress) of the last recorded update
+
+# Statuses after which the status file is fsynced, so a finished file's outcome survives a crash
+TERMINAL_STATUSES = ("completed", "error")
+
+
+def get_file_logger(filename):
+    """Get (or create) a logger that writes verbose messages to logs/{filename}.log"""
+    # Locked so concurrent workers for one file don't each attach a FileHandler
+    with _file_loggers_lock:
+        file_logger = _file_loggers.get(filename)
+        if file_logger is None:
+            os.makedirs(LOG_FOLDER, exist_ok=True)
+            file_logger = logging.getLogger(f"folder_processor.files.{filename}")
+            file_logger.setLevel(logging.INFO)
+            file_logger.propagate = False
+            handler = logging.FileHandler(os.path.join(LOG_FOLDER, f"{filename}.log"))
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            file_logger.addHandler(handler)
+            _file_loggers[filename] = file_logger
+        return file_logger
+
+
+def close_file_logger(filename):
+    """Close the per-file log handler once a file is finished, so its descriptor isn't held open"""
+    with _file_loggers_lock:
+        file_logger = _file_loggers.pop(filename, None)
+        if file_logger is None:
+            return
+        for handler in list(file_logger.handlers):
+            handler.close()
+            file_logger.removeHandler(handler)
+
+
+def _load_json_file(path):
+    """Parse a JSON file, with orjson when it is installed"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _read_status_file():
+    """Read processing status from the status file, falling back to the last snapshot if it is corrupted"""
     if os.path.exists(STATUS_FILE):
         try:
-            with open(STATUS_FILE, 'r') as f:
-                return json.load(f)
+            return _load_json_file(STATUS_FILE)
         except Exception as e:
             logger.error(f"Error loading status file: {e}")
-            # If the file exists but is corrupted, create a new empty status file
-            logger.warning("Creating a new empty status file due to corruption")
             try:
                 # Backup the corrupted file
                 if os.path.getsize(STATUS_FILE) > 0:
                     backup_file = f"{STATUS_FILE}.bak.{int(time.time())}"
                     shutil.copy(STATUS_FILE, backup_file)
                     logger.info(f"Backed up corrupted status file to {backup_file}")
-                
-                # Create a new empty file
-                with open(STATUS_FILE, 'w') as f:
-                    json.dump({}, f)
-                logger.info("Created new empty status file")
             except Exception as backup_error:
-                logger.error(f"Error creating backup or new status file: {backup_error}")
+                logger.error(f"Error backing up status file: {backup_error}")
+            
+            # Starting from an empty status would re-ingest every file in the folder
+            # (with duplicate vectors), so recover from the last snapshot instead
+            if os.path.exists(STATUS_SNAPSHOT_FILE):
+                try:
+                    status = _load_json_file(STATUS_SNAPSHOT_FILE)
+                    logger.warning(f"Recovered processing status from {STATUS_SNAPSHOT_FILE}")
+                    return status
+                except Exception as snapshot_error:
+                    logger.error(f"Error loading status snapshot: {snapshot_error}")
+            logger.warning("No usable status snapshot, starting with an empty status")
     return {}
 
 
-def save_status(status):
-    """Save processing status to the status file"""
+def _status_file_mtime():
+    """Modification time of STATUS_FILE in nanoseconds, or None if it doesn't exist"""
     try:
-        with open(STATUS_FILE, 'w') as f:
-            json.dump(status, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving status file: {e}")
+        return os.stat(STATUS_FILE).st_mtime_ns
+    except OSError:
+        return None
 
 
-def update_file_status(filename, current_status, progress=0, message="", error=None):
-    """Update status for a specific file with robust error handling"""
-    try:
-        # Load current status with a safety check
-        status = load_status()
-        if status is None:
-            logger.warning("Status file returned None, creating new empty status dictionary")
-            status = {}
-        
-        # Ensure we have a valid dictionary
+def _get_status_cache():
+    """
+    Return the in-memory status dict (caller holds the lock)
+    
+    It is loaded from the status file on first use and read back whenever the
+    file's mtime shows another process has written it since. Entries this process
+    changed but hasn't flushed yet are kept over the ones read back.
+    """
+    global _status_cache, _status_mtime
+    mtime = _status_file_mtime()
+    if _status_cache is not None and (mtime == _status_mtime or _status_replaced):
+        return _status_cache
+    
+    if _status_cache is None:
+        status = _read_status_file()
         if not isinstance(status, dict):
             logger.warning(f"Status file contained invalid data (type: {type(status)}), creating new status dictionary")
             status = {}
-        
-        # Initialize status entry if it doesn't exist
-        if filename not in status or not isinstance(status[filename], dict):
-            status[filename] = {
-                "start_time": datetime.now().isoformat(),
-                "status": current_status,
-                "progress": progress,
-                "messages": [],
-                "errors": [],
-                "chunks": 0  # Track processed chunks
-            }
-        else:
-            # Update existing status
-            status[filename]["status"] = current_status
-            status[filename]["progress"] = progress
-            status[filename]["last_updated"] = datetime.now().isoformat()
-        
-        # Ensure required arrays exist
-        if "messages" not in status[filename] or not isinstance(status[filename]["messages"], list):
-            status[filename]["messages"] = []
+    else:
+        # The other process may be halfway through a write; keep the current
+        # status and try again on the next call
+        try:
+            status = _load_json_file(STATUS_FILE)
+        except Exception:
+            return _status_cache
+        if not isinstance(status, dict):
+            return _status_cache
+        for name in _dirty_files:
+            if name in _status_cache:
+                status[name] = _status_cache[name]
+    
+    _status_cache = status
+    _status_mtime = mtime
+    return _status_cache
+
+
+def _mark_status_dirty():
+    """Schedule a debounced flush of the in-memory status (caller holds the lock)"""
+    global _status_dirty, _flush_timer
+    _status_dirty = True
+    if _flush_timer is None:
+        _flush_timer = threading.Timer(STATUS_FLUSH_INTERVAL, flush_status)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def _get_status_handle():
+    """Return the status file handle, opening (or creating) it on first use (caller holds the lock)"""
+    global _status_fh
+    if _status_fh is None or _status_fh.closed:
+        _status_fh = open(STATUS_FILE, 'r+b' if os.path.exists(STATUS_FILE) else 'w+b')
+    return _status_fh
+
+
+def _serialize_status():
+    """Encode the in-memory status as JSON bytes (caller holds the lock)"""
+    if orjson is not None:
+        return orjson.dumps(_status_cache, option=orjson.OPT_INDENT_2)
+    return json.dumps(_status_cache, indent=2).encode('utf-8')
+
+
+def _write_status_snapshot(data):
+    """Atomically replace STATUS_SNAPSHOT_FILE with data"""
+    temp_file = f"{STATUS_SNAPSHOT_FILE}.tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, STATUS_SNAPSHOT_FILE)
+
+
+def flush_status(sync=False):
+    """
+    Write the in-memory status to the status file if it has changed
+    
+    The file stays open and is rewritten in place, avoiding a new file and
+    directory entry per flush. Progress writes are left to the OS to persist;
+    sync=True also fsyncs and refreshes STATUS_SNAPSHOT_FILE, which is done for
+    terminal statuses and at exit.
+    """
+    global _status_dirty, _flush_timer, _status_mtime, _status_replaced
+    with _status_lock:
+        _flush_timer = None
+        if not _status_dirty and not sync:
+            return
+        try:
+            data = None
+            if _status_dirty:
+                # Pick up another process's changes first so they aren't overwritten
+                _get_status_cache()
+                data = _serialize_status()
+                fh = _get_status_handle()
+                fh.seek(0)
+                fh.write(data)
+                fh.truncate()
+                fh.flush()
+                _status_mtime = os.fstat(fh.fileno()).st_mtime_ns
+                _status_dirty = False
+                _status_replaced = False
+                _dirty_files.clear()
             
-        if "errors" not in status[filename] or not isinstance(status[filename]["errors"], list):
-            status[filename]["errors"] = []
-        
-        # Add message if provided
+            if sync and _status_fh is not None and not _status_fh.closed:
+                os.fsync(_status_fh.fileno())
+                _write_status_snapshot(data if data is not None else _serialize_status())
+        except Exception as e:
+            logger.error(f"Error saving status file: {e}")
+
+
+def close_status_file():
+    """Flush and fsync pending status changes and close the status file"""
+    global _status_fh
+    with _status_lock:
+        flush_status(sync=True)
+        if _status_fh is not None:
+            _status_fh.close()
+            _status_fh = None
+
+
+atexit.register(close_status_file)
+
+
+def load_status():
+    """Return a snapshot of the processing status"""
+    with _status_lock:
+        return {
+            name: dict(entry) if isinstance(entry, dict) else entry
+            for name, entry in _get_status_cache().items()
+        }
+
+
+def save_status(status):
+    """Replace the processing status; it is written to the status file on the next flush"""
+    global _status_cache, _status_replaced
+    with _status_lock:
+        _status_cache = status
+        _status_replaced = True
+        _mark_status_dirty()
+
+
+def update_file_status(filename, current_status, progress=0, message="", error=None, force=False, chunks=None):
+    """
+    Update status for a specific file with robust error handling
+    
+    Updates are applied to the in-memory status and written to the status file
+    at most once per STATUS_FLUSH_INTERVAL; force=True writes it immediately,
+    and terminal statuses are written and fsynced immediately.
+    Every message also goes to the per-file log. Updates that don't change the
+    status or progress percentage (and carry no error or chunk count) only go
+    to the per-file log.
+    """
+    # Full history goes to the per-file log
+    try:
         if message:
-            status[filename]["messages"].append({
-                "time": datetime.now().isoformat(),
-                "message": message
-            })
-        
-        # Add error if provided
+            get_file_logger(filename).info(message)
         if error:
-            status[filename]["errors"].append({
-                "time": datetime.now().isoformat(),
-                "error": str(error)
-            })
+            get_file_logger(filename).error(str(error))
+        if current_status in TERMINAL_STATUSES:
+            close_file_logger(filename)
+    except Exception as log_error:
+        logger.warning(f"Could not write to log file for {filename}: {log_error}")
+    
+    with _status_lock:
+        status = _get_status_cache()
         
-        # Save updated status
-        save_status(status)
-        return status
+        # Skip duplicate ticks - most consecutive batch updates land on the same percentage
+        tick = (current_status, progress)
+        if (not force and error is None and chunks is None and filename in status
+                and _last_progress.get(filename) == tick):
+            return status
+        _last_progress[filename] = tick
         
-    except Exception as e:
-        logger.error(f"Error updating file status for {filename}: {e}")
-        # Try to recover by creating a minimal status entry
         try:
-            minimal_status = {
-                filename: {
+            # Initialize status entry if it doesn't exist
+            if filename not in status or not isinstance(status[filename], dict):
+                status[filename] = {
+                    "start_time": datetime.now().isoformat(),
                     "status": current_status,
                     "progress": progress,
                     "messages": [],
-                    "errors": [{"time": datetime.now().isoformat(), "error": f"Status update failed: {str(e)}"}]
+                    "errors": [],
+                    "chunks": 0  # Track processed chunks
                 }
+            else:
+                # Update existing status
+                status[filename]["status"] = current_status
+                status[filename]["progress"] = progress
+                status[filename]["last_updated"] = datetime.now().isoformat()
+            
+            # Ensure required arrays exist
+            if "messages" not in status[filename] or not isinstance(status[filename]["messages"], list):
+                status[filename]["messages"] = []
+                
+            if "errors" not in status[filename] or not isinstance(status[filename]["errors"], list):
+                status[filename]["errors"] = []
+            
+            # Add message if provided - the status file only keeps the most recent messages
+            if message:
+                messages = deque(status[filename]["messages"], maxlen=MAX_STATUS_MESSAGES)
+                messages.append({
+                    "time": datetime.now().isoformat(),
+                    "message": message
+                })
+                status[filename]["messages"] = list(messages)
+                status[filename]["message_count"] = status[filename].get("message_count", 0) + 1
+                status[filename]["latest_message"] = message
+            
+            # Add error if provided (build a new list so snapshots handed out by load_status stay unchanged)
+            if error:
+                status[filename]["errors"] = status[filename]["errors"] + [{
+                    "time": datetime.now().isoformat(),
+                    "error": str(error)
+                }]
+            
+            if chunks is not None:
+                status[filename]["chunks"] = chunks
+            
+        except Exception as e:
+            logger.error(f"Error updating file status for {filename}: {e}")
+            # Try to recover by replacing this file's entry with a minimal one
+            status[filename] = {
+                "status": current_status,
+                "progress": progress,
+                "messages": [],
+                "errors": [{"time": datetime.now().isoformat(), "error": f"Status update failed: {str(e)}"}]
             }
-            save_status(minimal_status)
-            return minimal_status
-        except Exception as recovery_error:
-            logger.critical(f"Failed to recover from status update error: {recovery_error}")
-            return {}
+        
+        _dirty_files.add(filename)
+        _mark_status_dirty()
+        if current_status in TERMINAL_STATUSES:
+            flush_status(sync=True)
+        elif force:
+            flush_status()
+        return status
 
 
 def get_pending_files():
     """Get a list of files pending processing"""
-    files = []
-    
     # Get all files in the upload folder
-    for filename in os.listdir(UPLOAD_FOLDER):
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.isfile(filepath) and allowed_file(filename):
-            files.append(filename)
+    files = list_allowed_files(UPLOAD_FOLDER)
     
     # Load status to check which files are already processed
     status = load_status()
@@ -235,6 +653,105 @@ def get_pending_files():
 
 def process_file(filename):
     """Process a single file"""
+    try:
+        return _process_file(filename)
+    finally:
+        # Make sure the final status reaches the status file
+        flush_status()
+
+
+# Worker pool for process_file, and the files currently submitted to it. These threads
+# mostly wait on OpenAI and Pinecone; text extraction runs in cpu_executor instead.
+executor = ThreadPoolExecutor(max_workers=PROCESSOR_CONCURRENCY, thread_name_prefix="file-worker")
+_inflight = set()
+_inflight_lock = threading.Lock()
+
+# Metadata requests run here so they overlap with chunking and embedding of the same file
+metadata_executor = ThreadPoolExecutor(max_workers=PROCESSOR_CONCURRENCY, thread_name_prefix="metadata")
+
+# Embedding requests for all files, see embed_batches
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+
+cpu_executor = None
+_cpu_executor_lock = threading.Lock()
+
+
+def extract_text(filepath, file_ext):
+    """
+    Extract text in the process pool so several files can be parsed in parallel
+    
+    The pool is created on first use. If it can't be used (e.g. a worker died),
+    extraction runs in the calling thread instead.
+    """
+    global cpu_executor
+    if EXTRACT_WORKERS > 0:
+        try:
+            with _cpu_executor_lock:
+                if cpu_executor is None:
+                    # Spawned rather than forked: this runs in a thread of the Flask
+                    # process, and forking while other threads hold locks (logging,
+                    # the HTTP pools, the status lock) can deadlock the child
+                    cpu_executor = ProcessPoolExecutor(
+                        max_workers=EXTRACT_WORKERS,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+            return cpu_executor.submit(extract_text_from_file, filepath, file_ext).result()
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f"Extraction process pool unavailable ({e}), extracting in-thread")
+            with _cpu_executor_lock:
+                cpu_executor = None
+    return extract_text_from_file(filepath, file_ext)
+
+
+def submit_file(filename):
+    """
+    Queue a file on the worker pool unless it is already being processed
+    
+    Args:
+        filename (str): Name of the file in the upload folder
+        
+    Returns:
+        Future: The submitted job, or None if the file is already in flight
+    """
+    with _inflight_lock:
+        if filename in _inflight:
+            return None
+        _inflight.add(filename)
+    
+    logger.info(f"Processing {filename}")
+    future = executor.submit(process_file, filename)
+    future.filename = filename
+    
+    def release(_):
+        with _inflight_lock:
+            _inflight.discard(filename)
+    
+    future.add_done_callback(release)
+    return future
+
+
+def collect_results(futures, wait=False):
+    """
+    Log the outcome of finished jobs and drop them from the set
+    
+    Args:
+        futures (set): Futures returned by submit_file
+        wait (bool): Block until every job has finished
+    """
+    finished = as_completed(futures) if wait else [f for f in futures if f.done()]
+    for future in list(finished):
+        futures.discard(future)
+        try:
+            if future.result():
+                logger.info(f"Finished processing {future.filename}")
+            else:
+                logger.warning(f"Processing failed for {future.filename}")
+        except Exception as e:
+            logger.error(f"Error processing {future.filename}: {e}")
+
+
+def _process_file(filename):
+    """Extract, chunk, embed and store a single file, reporting progress in the status file"""
     # Check if API keys are available
     if not openai_available or not pinecone_available:
         update_file_status(
@@ -266,7 +783,14 @@ def process_file(filename):
         
         # Extract text from file
         update_file_status(filename, "processing", 5, f"Extracting text from {filename}")
-        extracted_text = extract_text_from_file(filepath, file_ext)
+        pdf_stream = None
+        if file_ext == 'pdf' and should_stream_pdf(filepath):
+            # Long PDF: pages are read straight into the chunker, so only the
+            # first pages' text is held here, for the metadata sample
+            pdf_stream = open_pdf_stream(filepath)
+            extracted_text = pdf_stream.head_text
+        else:
+            extracted_text = extract_text(filepath, file_ext)
         
         if not extracted_text:
             update_file_status(
@@ -278,22 +802,55 @@ def process_file(filename):
             )
             return False
         
-        update_file_status(filename, "processing", 15, f"Extracted {len(extracted_text)} characters from {filename}")
+        if pdf_stream is not None:
+            update_file_status(filename, "processing", 15, f"Streaming {pdf_stream.page_count} pages from {filename}")
+        else:
+            update_file_status(filename, "processing", 15, f"Extracted {len(extracted_text)} characters from {filename}")
         
         # Generate metadata
         update_file_status(filename, "processing", 20, f"Generating comprehensive metadata for {filename}")
         file_metadata = {}
         ai_tags = []
         
+        # The request runs in the background while the text is chunked and the
+        # first batches are embedded; its result is only needed for the chunk metadata
+        metadata_future = None
         if openai_available:
+            metadata_sample = sample_text(extracted_text)  # Strided sample from across the document
+            metadata_future = metadata_executor.submit(
+                generate_comprehensive_metadata,
+                text=metadata_sample,
+                filename=filename,
+                file_ext=file_ext,
+                max_tags=10
+            )
+            del metadata_sample
+        
+        # Chunk the text lazily - batches are embedded as soon as they are chunked.
+        # The real chunk count is only known once the stream is exhausted, so
+        # progress is reported against an estimate until then.
+        if pdf_stream is not None:
+            total_chunks = max(1, -(-pdf_stream.estimated_chars() // CHARS_PER_CHUNK_ESTIMATE))
+            chunks = iter_pdf_chunks(pdf_stream.pages)
+        else:
+            total_chunks = max(1, -(-len(extracted_text) // CHARS_PER_CHUNK_ESTIMATE))
+            chunks = iter_chunks(extracted_text)
+        
+        # Pipeline: chunking and embedding each run in their own thread, connected by
+        # bounded queues, so the next batch is chunked and embedded while this thread
+        # builds metadata and submits upserts for the current one. Several embedding
+        # requests are in flight at once, see embed_batches
+        chunk_batches = prefetch(enumerate(batched(chunks, BATCH_SIZE)))
+        del extracted_text, chunks  # The chunker keeps only the tokens, so the text can be freed
+        embedded_batches = prefetch(embed_batches(chunk_batches))
+        
+        # Start the pipeline: the first batch is chunked and embedded while the
+        # metadata request is in flight, and later batches keep running ahead
+        first_batch = next(embedded_batches, None)
+        
+        if metadata_future is not None:
             try:
-                sample_text = extracted_text[:20000]  # Use first 20k chars for metadata generation
-                metadata_result = generate_comprehensive_metadata(
-                    text=sample_text,
-                    filename=filename,
-                    file_ext=file_ext,
-                    max_tags=10
-                )
+                metadata_result = metadata_future.result()
                 
                 # Safety check - ensure we have a valid dictionary
                 if metadata_result and isinstance(metadata_result, dict):
@@ -348,23 +905,46 @@ def process_file(filename):
                 )
                 # Continue even if metadata generation fails
         
-        # Chunk the text
+        # One id per file; chunk ids are "{doc_uuid}_{chunk_index:06d}", so a file's
+        # vectors sort together and can be listed or deleted by prefix
+        doc_uuid = uuid.uuid4().hex
+        
+        # Small, filterable fields are kept on every chunk
+        chunk_metadata_base = {
+            'filename': filename,
+            'doc_id': doc_uuid,
+            'filetype': file_ext,
+            'subject': file_metadata.get('subject', 'general'),
+            'tags': ai_tags if ai_tags else [],  # Ensure tags is a list
+            'source': 'folder_upload',
+        }
+        
+        # The full file metadata is stored once under the document id instead of in every chunk
+        shared_metadata = {k: v for k, v in file_metadata.items() if k != 'general_tags'}
+        if pinecone_manager and not pinecone_manager.upsert_document(doc_uuid, {**shared_metadata, **chunk_metadata_base}):
+            logger.warning(f"Could not store document metadata for {filename}")
+        
         update_file_status(filename, "processing", 35, f"Chunking text content")
-        chunks = chunk_text(extracted_text)
-        total_chunks = len(chunks)
         update_file_status(
             filename, 
             "processing", 
             40, 
-            f"Chunked text into {total_chunks} segments for processing"
+            f"Streaming text into approximately {total_chunks} segments for processing"
         )
         
         # Process in batches to avoid timeouts
         processed_chunks = 0
+        chunks_seen = 0
+        pending_upserts = []  # (batch number, vectors, async upsert result)
         batch_sizes = []
         
-        for i in range(0, total_chunks, BATCH_SIZE):
-            batch = chunks[i:i+BATCH_SIZE]
+        if first_batch is not None:
+            embedded_batches = chain([first_batch], embedded_batches)
+        
+        for batch_number, batch, batch_result, batch_errors, first_batch_error in embedded_batches:
+            i = batch_number * BATCH_SIZE
+            chunks_seen += len(batch)
+            total_chunks = max(total_chunks, chunks_seen)
             batch_embeddings = []
             batch_metadata = []
             batch_ids = []
@@ -372,63 +952,45 @@ def process_file(filename):
             update_file_status(
                 filename, 
                 "processing", 
-                40 + int((i / total_chunks) * 50), 
-                f"Processing batch {i//BATCH_SIZE + 1} of {(total_chunks + BATCH_SIZE - 1)//BATCH_SIZE}"
+                chunk_progress(i, total_chunks), 
+                f"Processing batch {batch_number + 1} of ~{(total_chunks + BATCH_SIZE - 1)//BATCH_SIZE}"
             )
             
-            # Generate embeddings for the batch
             for j, chunk in enumerate(batch):
                 chunk_index = i + j
                 try:
-                    # Update status for each chunk
-                    update_file_status(
-                        filename, 
-                        "processing", 
-                        40 + int(((i + j) / total_chunks) * 50), 
-                        f"Generating embedding for chunk {chunk_index + 1}/{total_chunks}"
-                    )
-                    
-                    # Generate embeddings with retry
-                    embedding = generate_embeddings(chunk, max_retries=2)
+                    embedding = batch_result[j]
                     
                     if embedding and len(embedding) > 0:
-                        # Create metadata with defaults for safety
-                        metadata = {
-                            'text': chunk,
-                            'filename': filename,
-                            'filetype': file_ext,
-                            'subject': 'general',  # Default subject
-                            'tags': ai_tags if ai_tags else [],  # Ensure tags is a list
-                            'chunk_id': chunk_index,
-                            'source': 'folder_upload',
-                        }
+                        # Only chunk-specific and filterable fields are stored per chunk;
+                        # the rest of the file metadata lives once under doc_id
+                        metadata = {**chunk_metadata_base, 'text': chunk, 'chunk_id': chunk_index}
                         
-                        # Add subject from metadata if available
-                        if file_metadata and isinstance(file_metadata, dict):
-                            if 'subject' in file_metadata:
-                                metadata['subject'] = file_metadata['subject']
-                            
-                            # Add comprehensive AI-generated metadata if available
-                            for key, value in file_metadata.items():
-                                if key != 'general_tags':  # Skip general tags as they're already in the tags field
-                                    metadata[key] = value
-                                    
                         # Add to batch for upserting
-                        batch_embeddings.append(embedding)
+                        batch_embeddings.append(quantize_embedding(embedding))
                         batch_metadata.append(metadata)
-                        batch_ids.append(f"{uuid.uuid4()}")
+                        batch_ids.append(f"{doc_uuid}_{chunk_index:06d}")
                 
                 except Exception as e:
-                    logger.error(f"Error processing chunk {chunk_index}: {e}")
-                    update_file_status(
-                        filename, 
-                        "processing", 
-                        40 + int(((i + j) / total_chunks) * 50), 
-                        f"Warning: Failed to process chunk {chunk_index}", 
-                        str(e)
-                    )
+                    # Collect failures and report them once per batch
+                    batch_errors.append(f"chunk {chunk_index}: {e}")
+                    if first_batch_error is None:
+                        first_batch_error = e
                     # Continue with other chunks
             
+            if batch_errors:
+                logger.error(
+                    f"{len(batch_errors)} chunks failed in batch {batch_number + 1}: {'; '.join(batch_errors)}",
+                    exc_info=first_batch_error
+                )
+                update_file_status(
+                    filename, 
+                    "processing", 
+                    chunk_progress(i + len(batch), total_chunks), 
+                    f"Warning: Failed to process {len(batch_errors)} chunks in batch {batch_number + 1}", 
+                    f"{len(batch_errors)} chunks failed: {batch_errors[0]}"
+                )
+            
             # Upsert the batch to Pinecone
             if batch_embeddings:
                 try:
@@ -446,49 +1008,22 @@ def process_file(filename):
                     update_file_status(
                         filename, 
                         "processing", 
-                        40 + int(((i + len(batch)) / total_chunks) * 50), 
-                        f"Storing batch {i//BATCH_SIZE + 1} ({len(vectors)} vectors) in Pinecone"
+                        chunk_progress(i + len(batch), total_chunks), 
+                        f"Storing batch {batch_number + 1} ({len(vectors)} vectors) in Pinecone"
                     )
                     
                     # Batch upsert to Pinecone
                     if pinecone_manager and pinecone_manager.index:
-                        # Get vector count before upsert
-                        try:
-                            before_stats = pinecone_manager.describe_index_stats()
-                            before_count = before_stats.get('total_vector_count', 0)
-                        except Exception as stats_error:
-                            logger.warning(f"Could not get before stats: {stats_error}")
-                            before_count = 0
-                        
-                        # Perform the upsert
-                        upsert_response = pinecone_manager.index.upsert(vectors=vectors, namespace="default")
-                        processed_chunks += len(vectors)
-                        
-                        # Update chunk count in status file
-                        status = load_status()
-                        if status and filename in status and isinstance(status[filename], dict):
-                            status[filename]["chunks"] = processed_chunks
-                            save_status(status)
-                        
-                        # Get vector count after upsert
-                        try:
-                            after_stats = pinecone_manager.describe_index_stats()
-                            after_count = after_stats.get('total_vector_count', 0)
-                            # Log the difference in vector count
-                            vectors_added = int(after_count) - int(before_count)
-                        except Exception as stats_error:
-                            logger.warning(f"Could not get after stats: {stats_error}")
-                            after_count = processed_chunks
-                            vectors_added = len(vectors)
-                        logger.info(f"Added {vectors_added} vectors to Pinecone (upsert batch size: {len(vectors)})")
-                        logger.info(f"Pinecone now contains {after_count} total vectors")
-                        
-                        update_file_status(
-                            filename, 
-                            "processing", 
-                            40 + int(((i + len(batch)) / total_chunks) * 50), 
-                            f"Stored batch {i//BATCH_SIZE + 1} in Pinecone (added {vectors_added} vectors), total: {after_count}"
-                        )
+                        # Submit the upserts to the index's thread pool, split to fit the
+                        # request size limits; results are collected once every batch has been submitted
+                        for packed in pack_vectors(vectors):
+                            upsert_result = pinecone_manager.index.upsert(
+                                vectors=packed,
+                                namespace="default",
+                                async_req=True
+                            )
+                            pending_upserts.append((batch_number, packed, upsert_result))
+                            logger.info(f"Submitted {len(packed)} vectors to Pinecone")
                     else:
                         raise Exception("Pinecone index not initialized")
                         
@@ -497,16 +1032,46 @@ def process_file(filename):
                     update_file_status(
                         filename, 
                         "processing", 
-                        40 + int(((i + len(batch)) / total_chunks) * 50), 
-                        f"Error: Failed to store batch {i//BATCH_SIZE + 1} in Pinecone", 
+                        chunk_progress(i + len(batch), total_chunks), 
+                        f"Error: Failed to store batch {batch_number + 1} in Pinecone", 
                         str(batch_error)
                     )
             
-            # Short delay between batches to avoid rate limiting
-            time.sleep(0.5)
+        # The chunk stream is exhausted, so the real count is known now
+        total_chunks = chunks_seen
+        
+        # Wait for the in-flight upserts to finish; transient failures are retried
+        for batch_number, packed, upsert_result in pending_upserts:
+            try:
+                response = pinecone_manager.finish_upsert(packed, upsert_result)
+                # Trust the upsert response rather than polling index stats per batch
+                vector_count = getattr(response, 'upserted_count', None) or len(packed)
+                processed_chunks += vector_count
+                update_file_status(
+                    filename, 
+                    "processing", 
+                    90, 
+                    f"Stored batch {batch_number + 1} in Pinecone ({vector_count} vectors)",
+                    force=True
+                )
+            except Exception as batch_error:
+                logger.error(f"Error upserting batch to Pinecone: {batch_error}")
+                update_file_status(
+                    filename, 
+                    "processing", 
+                    90, 
+                    f"Error: Failed to store batch {batch_number + 1} in Pinecone", 
+                    str(batch_error)
+                )
         
         # Verify processing
-        update_file_status(filename, "verifying", 95, "Verifying document processing")
+        update_file_status(
+            filename, 
+            "verifying", 
+            95, 
+            "Verifying document processing", 
+            chunks=processed_chunks
+        )
         
         if processed_chunks > 0:
             try:
@@ -515,23 +1080,13 @@ def process_file(filename):
                     stats = pinecone_manager.describe_index_stats()
                     vector_count = stats.get('total_vector_count', 0)
                     # Update status to include the final chunk count and vector summary
-                    # First retrieve the current status to ensure we preserve the chunks field
-                    current_status = load_status().get(filename, {})
-                    
-                    # Now update with the complete information
                     update_file_status(
                         filename, 
                         "verified", 
                         98, 
-                        f"Verified storage in Pinecone. Total vectors in index: {vector_count}"
+                        f"Verified storage in Pinecone. Total vectors in index: {vector_count}", 
+                        chunks=processed_chunks
                     )
-                    
-                    # Make sure chunks count is stored in the status
-                    status = load_status()
-                    if status and filename in status:
-                        if "chunks" not in status[filename] or not status[filename]["chunks"]:
-                            status[filename]["chunks"] = processed_chunks
-                            save_status(status)
             except Exception as e:
                 logger.error(f"Error verifying Pinecone status: {e}")
                 update_file_status(
@@ -554,7 +1109,7 @@ def process_file(filename):
         # Move file to processed folder
         try:
             processed_path = os.path.join(PROCESSED_FOLDER, filename)
-            shutil.move(filepath, processed_path)
+            move_to_processed(filepath, processed_path)
             update_file_status(
                 filename, 
                 "completed", 
@@ -580,10 +1135,94 @@ def process_file(filename):
         return False
 
 
+def _start_watcher(enqueue):
+    """Start a watchdog observer that reports supported files added to the upload folder"""
+    upload_dir = os.path.abspath(UPLOAD_FOLDER)
+    
+    class UploadFolderHandler(FileSystemEventHandler):
+        def _report(self, path):
+            if os.path.dirname(os.path.abspath(path)) == upload_dir and path.lower().endswith(ALLOWED_SUFFIXES):
+                enqueue(os.path.basename(path))
+        
+        def on_closed(self, event):
+            # Fired once the writer closes the file, so uploads are never picked up half-written
+            if not event.is_directory:
+                self._report(event.src_path)
+        
+        def on_moved(self, event):
+            if not event.is_directory:
+                self._report(event.dest_path)
+    
+    observer = Observer()
+    observer.schedule(UploadFolderHandler(), UPLOAD_FOLDER, recursive=False)
+    observer.start()
+    return observer
+
+
+def _run_watch_loop():
+    """Process files as the watcher reports them, instead of polling the upload folder"""
+    file_queue = queue.Queue()
+    futures = set()
+    queued = set()
+    queued_lock = threading.Lock()
+    
+    def enqueue(filename):
+        with queued_lock:
+            if filename in queued:
+                return
+            queued.add(filename)
+        file_queue.put(filename)
+    
+    observer = _start_watcher(enqueue)
+    logger.info(f"Watching {UPLOAD_FOLDER} for new files")
+    try:
+        # Pick up files that were already there before the watcher started
+        for filename in get_pending_files():
+            enqueue(filename)
+        
+        while True:
+            try:
+                filename = file_queue.get(timeout=WATCH_RESCAN_INTERVAL)
+            except queue.Empty:
+                collect_results(futures)
+                # A periodic rescan retries failed or stuck files and covers any missed events
+                for filename in get_pending_files():
+                    enqueue(filename)
+                continue
+            
+            with queued_lock:
+                queued.discard(filename)
+            
+            try:
+                if filename in get_pending_files():
+                    future = submit_file(filename)
+                    if future:
+                        futures.add(future)
+            except Exception as e:
+                logger.error(f"Error in processor loop: {e}")
+            collect_results(futures)
+    finally:
+        observer.stop()
+        observer.join()
+
+
 def run_processor(continuous=True):
     """Run the folder processor"""
     logger.info(f"Starting folder processor. Monitoring {UPLOAD_FOLDER} for files...")
     
+    # Use filesystem events when possible; polling remains for one-off runs, when
+    # watchdog isn't installed, or when events are unreliable (e.g. network shares)
+    if continuous and FOLDER_WATCH_MODE != "poll" and Observer is not None:
+        try:
+            _run_watch_loop()
+            return
+        except KeyboardInterrupt:
+            logger.info("Processor stopped by user")
+            return
+        except Exception as e:
+            logger.warning(f"File watcher failed ({e}), falling back to polling")
+    
+    futures = set()
     while True:
         try:
             # Get pending files
@@ -592,15 +1231,19 @@ def run_processor(continuous=True):
             if pending_files:
                 logger.info(f"Found {len(pending_files)} files to process")
                 
-                # Process each file
+                # Hand each file to the worker pool; files still in flight are skipped
                 for filename in pending_files:
-                    logger.info(f"Processing {filename}")
-                    process_file(filename)
+                    future = submit_file(filename)
+                    if future:
+                        futures.add(future)
             
             # Check if we should continue monitoring
             if not continuous:
+                collect_results(futures, wait=True)
                 break
             
+            collect_results(futures)
+            
             # Wait before checking again
             time.sleep(5)
             
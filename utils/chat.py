@@ -1,51 +1,181 @@
 import os
+import functools
 import logging
+import threading
 import json
 import re
-from openai import OpenAI
+import hashlib
+import time
+import tiktoken
+from collections import Counter
+from utils.openai_client import get_client, OPENAI_GENERATION_TIMEOUT
+from utils.rate_limit import retry_with_backoff, is_fatal_error, OPENAI_RETRY_ATTEMPTS
+from utils import llm_cache, semantic_cache
 
 logger = logging.getLogger(__name__)
 
+# orjson parses model responses several times faster than the stdlib; fall back if it
+# isn't installed. orjson.JSONDecodeError subclasses json.JSONDecodeError.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # Initialize OpenAI client
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 client = None
 
 if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = get_client(OPENAI_API_KEY)
 else:
     logger.warning("OPENAI_API_KEY not set in environment variables")
     # Client will be initialized later when the key is available
 
-def generate_comprehensive_metadata(text, filename="", file_ext="", max_tags=8, max_retries=3):
+_client_lock = threading.Lock()
+
+def ensure_client():
     """
-    Generate comprehensive metadata and tags for document chunks using OpenAI's GPT-4o model
+    Get the module's OpenAI client, creating it once the API key is available
+    
+    The API key may be added after import, so the client is created on first use;
+    the lock makes sure concurrent callers don't each build one.
     
-    Args:
-        text (str): Text content to analyze
-        filename (str): Original filename
-        file_ext (str): File extension/type
-        max_tags (int): Maximum number of general tags to generate
-        max_retries (int): Maximum number of retry attempts for API calls
-        
     Returns:
-        dict: Comprehensive metadata including various tag categories
+        OpenAI: Shared client, or None if no API key is set
     """
     global client, OPENAI_API_KEY
-    
-    # Check if client is available
     if client is None:
-        # Try to get API key again in case it was added after initialization
-        OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-        if OPENAI_API_KEY:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-        else:
-            logger.error("OpenAI client not initialized - API key is missing")
-            return {}
+        with _client_lock:
+            if client is None:
+                OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+                if OPENAI_API_KEY:
+                    client = get_client(OPENAI_API_KEY)
+    return client
+
+@functools.lru_cache(maxsize=256)
+def _count_tokens(text):
+    """Count tokens with the gpt-4o tokenizer; cached, so the static system prompts and
+    frequently retrieved chunks are encoded once"""
+    global _encoding
+    try:
+        if _encoding is None:
+            _encoding = tiktoken.encoding_for_model("gpt-4o")
+        return len(_encoding.encode(text))
+    except Exception:
+        return len(text) // 4
+
+def _estimate_tokens(params):
+    """Estimate the tokens a chat request counts against the per-minute budget"""
+    input_tokens = sum(_count_tokens(message["content"]) for message in params.get("messages", ()))
+    return input_tokens + params.get("max_tokens", 0) * params.get("n", 1)
+
+def _log_prompt_cache(usage):
+    """
+    Log how much of a request's prompt was served from OpenAI's prompt cache
     
-    import time
+    Cached tokens are billed at a discount and prefilled faster; they only count when
+    the request starts with the same prefix as a recent one, which is why the system
+    prompts are static and the variable content goes last.
+    """
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    logger.debug(f"Prompt tokens: {usage.prompt_tokens}, cached: {cached_tokens}")
+
+def _create_chat(max_attempts=OPENAI_RETRY_ATTEMPTS, **params):
+    """
+    Create a chat completion, retrying rate limits, timeouts and connection errors
+    with jittered exponential backoff (see utils.rate_limit.retry_with_backoff)
     
-    # Define default metadata structure with safe values
-    default_metadata = {
+    This is the only retry layer for chat requests; callers pass their max_retries
+    as max_attempts and handle the final error.
+    
+    The request's estimated token count is taken from the shared tokens-per-minute
+    limiter first, so concurrent callers stay under the budget instead of hitting 429s.
+    Streaming requests get their usage in the final chunk (see _log_prompt_cache).
+    Non-streaming requests wait for the whole completion, so they get the longer
+    OPENAI_GENERATION_TIMEOUT instead of the pool's per-read timeout; a timeout
+    here would otherwise be retried as a new billed request.
+    """
+    if params.get("stream"):
+        params.setdefault("stream_options", {"include_usage": True})
+    else:
+        params.setdefault("timeout", OPENAI_GENERATION_TIMEOUT)
+    response = retry_with_backoff(
+        lambda: client.chat.completions.create(**params),
+        max_attempts=max_attempts,
+        tokens=_estimate_tokens(params)
+    )
+    if not params.get("stream"):
+        _log_prompt_cache(getattr(response, "usage", None))
+    return response
+
+# Metadata tagging is structured extraction, which the smaller model handles well at a
+# fraction of the cost and latency; the JSON for all categories fits in ~300 tokens
+METADATA_MODEL = os.environ.get("METADATA_MODEL", "gpt-4o-mini")
+METADATA_MAX_TOKENS = int(os.environ.get("METADATA_MAX_TOKENS", 400))
+
+# Matches the keyword and follow-up question buttons the model is asked to emit
+_TAG_RE = re.compile(r'<button class="(keyword|follow-up-question)">(.*?)</button>', re.DOTALL)
+
+def extract_buttons(answer_html):
+    """
+    Extract keyword and follow-up question buttons from a response in one pass
+    
+    Args:
+        answer_html (str): HTML response from the model
+        
+    Returns:
+        tuple: (keywords, follow_up_questions) lists of button texts
+    """
+    keywords, follow_up_questions = [], []
+    # Substring search is much cheaper than a regex scan for answers without buttons
+    if "<button" not in answer_html:
+        return keywords, follow_up_questions
+    for button_class, button_text in _TAG_RE.findall(answer_html):
+        (keywords if button_class == "keyword" else follow_up_questions).append(button_text)
+    return keywords, follow_up_questions
+
+_BUTTON_OPEN = '<button class="'
+_BUTTON_CLOSE = "</button>"
+_KEYWORD_OPEN = '<button class="keyword">'
+_FOLLOW_UP_OPEN = '<button class="follow-up-question">'
+
+def _scan_closed_buttons(text, search_pos, button_end):
+    """
+    Collect the buttons closed in a growing response since the previous scan
+    
+    Uses plain substring search: each closing tag is found once and matched to the
+    nearest opener before it, so text between buttons is never rescanned.
+    
+    Args:
+        text (str): Response so far
+        search_pos (int): Where to resume looking for a closing tag
+        button_end (int): End of the last complete button (openers are searched after it)
+        
+    Returns:
+        tuple: (keywords, follow_up_questions, search_pos, button_end) for the next scan
+    """
+    keywords, follow_up_questions = [], []
+    while True:
+        close = text.find(_BUTTON_CLOSE, search_pos)
+        if close == -1:
+            # A closing tag may be split across tokens; resume just before the tail
+            return keywords, follow_up_questions, max(search_pos, len(text) - len(_BUTTON_CLOSE) + 1), button_end
+        
+        opener = text.rfind(_BUTTON_OPEN, button_end, close)
+        if opener != -1:
+            if text.startswith(_KEYWORD_OPEN, opener):
+                keywords.append(text[opener + len(_KEYWORD_OPEN):close])
+            elif text.startswith(_FOLLOW_UP_OPEN, opener):
+                follow_up_questions.append(text[opener + len(_FOLLOW_UP_OPEN):close])
+        search_pos = button_end = close + len(_BUTTON_CLOSE)
+
+def _default_metadata():
+    """Return a fresh default metadata structure with safe values"""
+    return {
         "general_tags": [],
         "subject": "general",
         "subcategory": "document",
@@ -61,6 +191,243 @@ def generate_comprehensive_metadata(text, filename="", file_ext="", max_tags=8,
         "education_use_case": "reading",
         "question_tags": []
     }
+
+# Static system prompts. They are kept byte-for-byte identical across calls and sent
+# first, so the provider's automatic prompt caching can reuse the processed prefix;
+# per-call values such as max_tags go in the user message instead.
+SYSTEM_METADATA_PROMPT = """
+You are an expert document analyzer and metadata tagger. Analyze the provided text and extract detailed, structured metadata.
+Create appropriate tags for each of the following categories:
+
+1. subject - Core domain/topic (e.g., finance, investing, real estate, psychology)
+2. subcategory - More specific topic (e.g., ETFs, technical analysis, habit formation)
+3. skill_level - Learning level (e.g., beginner, intermediate, advanced)
+4. chunk_summary - Short summary (1-2 sentences) of the content
+5. key_points - List of 3-5 important ideas/facts in the content
+6. chunk_type - Type of content (definition, how-to, case study, example, tip, principle)
+7. concepts_covered - List of key concepts, terms, or formulas mentioned
+8. prerequisites - Topics or knowledge needed to understand this content
+9. next_steps - Logical follow-up topics or learning suggestions
+10. learning_objective - What the user is expected to learn from this content
+11. application_context - Where or how this knowledge is applied (e.g., investing, health, education)
+12. education_use_case - Tag for learning tasks (e.g., quiz_candidate, lesson_topic, glossary)
+13. question_tags - Potential quiz or flashcard prompts (1-3 questions)
+14. general_tags - List of general tags/keywords that describe the content (the user message gives how many)
+
+Format your response as a JSON object with each category as a key. Use arrays for lists and keep the format clean and consistent.
+If a category is not applicable, use an empty array or appropriate default.
+"""
+
+SYSTEM_METADATA_BATCH_PROMPT = SYSTEM_METADATA_PROMPT + """
+You will receive several items, each starting with a line like "=== ITEM 0 ===".
+Analyze each item separately and respond with a JSON object of the form
+{"results": [{"item": 0, ...}, {"item": 1, ...}]}, where each entry holds the item number and the categories above for that item.
+"""
+
+# Structured output schemas: the model is constrained to exactly these fields and
+# types, so responses no longer come back with missing keys or strings in list fields
+_STRING_FIELDS = ("subject", "subcategory", "skill_level", "chunk_summary", "chunk_type",
+                  "learning_objective", "application_context", "education_use_case")
+_ARRAY_FIELDS = ("key_points", "concepts_covered", "prerequisites", "next_steps",
+                 "question_tags", "general_tags")
+
+_METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{field: {"type": "string"} for field in _STRING_FIELDS},
+        **{field: {"type": "array", "items": {"type": "string"}} for field in _ARRAY_FIELDS}
+    },
+    "required": list(_STRING_FIELDS + _ARRAY_FIELDS),
+    "additionalProperties": False
+}
+
+_METADATA_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                **_METADATA_SCHEMA,
+                "properties": {"item": {"type": "integer"}, **_METADATA_SCHEMA["properties"]},
+                "required": ["item"] + _METADATA_SCHEMA["required"]
+            }
+        }
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+
+METADATA_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "comprehensive_metadata", "strict": True, "schema": _METADATA_SCHEMA}
+}
+METADATA_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "comprehensive_metadata_batch", "strict": True, "schema": _METADATA_BATCH_SCHEMA}
+}
+
+SYSTEM_CHAT_PROMPT = """
+You are a witty, friendly educational assistant that explains complex concepts with clarity and humor.
+Use metaphors and analogies to make concepts more understandable. Be conversational but educational.
+Format your response in HTML. Identify key concepts that could be useful for further learning,
+and format them as clickable buttons using HTML <button class="keyword">Concept</button> tags.
+
+Include 2-3 follow-up questions at the end of your response as buttons with the class "follow-up-question".
+
+For example: <button class="follow-up-question">Tell me more about X?</button>
+
+Format the response as follows:
+1. Main answer with metaphors, analogies, and highlighted <button class="keyword">keywords</button>
+2. A brief summary section (in a <div class="summary"></div>)
+3. Follow-up questions (as buttons with class "follow-up-question")
+"""
+
+# Shared system message dicts, reused by every request instead of being rebuilt per
+# call. They are shared, so never mutate them.
+_METADATA_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_METADATA_PROMPT}
+_METADATA_BATCH_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_METADATA_BATCH_PROMPT}
+_CHAT_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_CHAT_PROMPT}
+
+def _metadata_user_message(text, filename, file_ext, max_tags):
+    """Build the per-document user message for a metadata request"""
+    return (f"Filename: {filename}\nFile type: {file_ext}\nNumber of general_tags: {max_tags}\n\n"
+            f"Content for analysis: {text}")
+
+# Token budget for the text sent with a metadata request. Counting tokens rather than
+# characters keeps dense text (code, CJK) within budget and lets prose use all of it.
+METADATA_MAX_INPUT_TOKENS = int(os.environ.get("METADATA_MAX_INPUT_TOKENS", 6000))
+
+_encoding = None
+
+def _truncate_to_tokens(text, max_tokens=METADATA_MAX_INPUT_TOKENS):
+    """
+    Truncate text to at most max_tokens tokens of the gpt-4o tokenizer
+    
+    Args:
+        text (str): Text to truncate
+        max_tokens (int): Token budget
+        
+    Returns:
+        str: The text, shortened if it exceeded the budget
+    """
+    global _encoding
+    try:
+        # The BPE table is built once and reused
+        if _encoding is None:
+            _encoding = tiktoken.encoding_for_model("gpt-4o")
+        tokens = _encoding.encode(text)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, truncating by characters: {e}")
+        return text[:max_tokens * 4]
+    
+    if len(tokens) <= max_tokens:
+        return text
+    
+    logger.debug(f"Text too long ({len(tokens)} tokens), truncating to {max_tokens} tokens for metadata generation")
+    return _encoding.decode(tokens[:max_tokens])
+
+# Texts shorter than this (headings, page numbers, TOC entries), with fewer words or
+# distinct words than this, or made up mostly of punctuation/digits (tables of
+# contents, separators) get deterministic metadata instead of a model call; there is
+# too little content to tag
+METADATA_MIN_CHARS = int(os.environ.get("METADATA_MIN_CHARS", 120))
+METADATA_MIN_WORDS = int(os.environ.get("METADATA_MIN_WORDS", 30))
+METADATA_MIN_UNIQUE_WORDS = int(os.environ.get("METADATA_MIN_UNIQUE_WORDS", 10))
+METADATA_MIN_ALPHA_RATIO = 0.5
+
+# The word thresholds and local tags assume words are separated by spaces. Scripts
+# written without them (Chinese, Japanese, Thai) give very long "words", so text
+# whose whitespace-separated tokens average more characters than this skips them.
+METADATA_MAX_AVG_WORD_CHARS = 20
+
+_WORD_RE = re.compile(r"[^\W\d_][\w'-]{3,}")
+_STOPWORDS = frozenset("""
+    about above after again against also among because been before being below between both
+    could does doing down during each every from further have having here into itself just
+    more most only other over same should some such than that their them then there these
+    they this those through under until very were what when where which while will with
+    would your page chapter
+""".split())
+
+def _is_space_delimited(text, words):
+    """Return True if a text's words are separated by whitespace"""
+    return len(text) <= METADATA_MAX_AVG_WORD_CHARS * max(1, len(words))
+
+def _is_low_content(text):
+    """Return True if a text has too little content to be worth a metadata request"""
+    stripped = text.strip()
+    if len(stripped) < METADATA_MIN_CHARS:
+        return True
+    
+    words = stripped.lower().split()
+    if _is_space_delimited(stripped, words) and (
+        len(words) < METADATA_MIN_WORDS or len(set(words)) < METADATA_MIN_UNIQUE_WORDS
+    ):
+        return True
+    
+    # Only the start is checked; that is enough to recognise dot leaders and number tables
+    sample = stripped[:2000]
+    return sum(char.isalpha() for char in sample) < METADATA_MIN_ALPHA_RATIO * len(sample)
+
+def _local_tags(text, max_tags=8):
+    """Pick tags for a short text without a model call: its most frequent content words"""
+    # Without spaces between words there is no cheap way to find them
+    if not _is_space_delimited(text.strip(), text.split()):
+        return []
+    counts = Counter(word for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS)
+    return [word for word, _ in counts.most_common(max_tags)]
+
+def _fragment_metadata(text, filename="", max_tags=8):
+    """Return minimal metadata for a text too short to be worth analyzing"""
+    metadata = _default_metadata()
+    metadata["chunk_summary"] = text.strip()[:200]
+    metadata["chunk_type"] = "fragment"
+    metadata["general_tags"] = _local_tags(text, max_tags)
+    return _normalize_metadata(metadata, filename)
+
+# List fields stored as strings, with the formatter used for each
+_LIST_FIELDS = (
+    ("key_points", lambda points: "\n".join(f"• {point}" for point in points)),
+    ("concepts_covered", lambda concepts: ", ".join(map(str, concepts))),
+    ("prerequisites", lambda prerequisites: ", ".join(map(str, prerequisites))),
+)
+
+def _normalize_metadata(metadata, filename=""):
+    """Add the source filename and convert list fields to strings for compatibility with existing code"""
+    # Add source filename if provided
+    if filename:
+        metadata["source_filename"] = filename
+    
+    # Convert lists to string for compatibility with existing code where needed
+    for field, fmt in _LIST_FIELDS:
+        value = metadata.get(field)
+        if isinstance(value, list):
+            metadata[field] = fmt(value)
+    
+    return metadata
+
+def generate_comprehensive_metadata(text, filename="", file_ext="", max_tags=8, max_retries=3, cache=llm_cache.LLM_CACHE_ENABLED):
+    """
+    Generate comprehensive metadata and tags for document chunks using METADATA_MODEL (gpt-4o-mini by default)
+    
+    Args:
+        text (str): Text content to analyze
+        filename (str): Original filename
+        file_ext (str): File extension/type
+        max_tags (int): Maximum number of general tags to generate
+        max_retries (int): Maximum number of retry attempts for API calls
+        cache (bool): Reuse the response for an identical earlier request
+        
+    Returns:
+        dict: Comprehensive metadata including various tag categories
+    """
+    # Check if client is available
+    if ensure_client() is None:
+        logger.error("OpenAI client not initialized - API key is missing")
+        return {}
+    
+    # Define default metadata structure with safe values
+    default_metadata = _default_metadata()
     
     # Clean and prepare text
     if not text or text.strip() == "":
@@ -68,124 +435,240 @@ def generate_comprehensive_metadata(text, filename="", file_ext="", max_tags=8,
         default_metadata["chunk_summary"] = "Empty document"
         return default_metadata
     
+    # Fast path for fragments that don't need a model call
+    if _is_low_content(text):
+        return _fragment_metadata(text, filename, max_tags)
+    
     # Truncate text if it's very long
-    if len(text) > 15000:
-        logger.warning(f"Text too long ({len(text)} chars), truncating to 15000 chars for metadata generation")
-        text = text[:15000]
-        
-        system_message = f"""
-        You are an expert document analyzer and metadata tagger. Analyze the provided text and extract detailed, structured metadata.
-        Create appropriate tags for each of the following categories:
-        
-        1. subject - Core domain/topic (e.g., finance, investing, real estate, psychology)
-        2. subcategory - More specific topic (e.g., ETFs, technical analysis, habit formation)
-        3. skill_level - Learning level (e.g., beginner, intermediate, advanced)
-        4. chunk_summary - Short summary (1-2 sentences) of the content
-        5. key_points - List of 3-5 important ideas/facts in the content
-        6. chunk_type - Type of content (definition, how-to, case study, example, tip, principle)
-        7. concepts_covered - List of key concepts, terms, or formulas mentioned
-        8. prerequisites - Topics or knowledge needed to understand this content
-        9. next_steps - Logical follow-up topics or learning suggestions
-        10. learning_objective - What the user is expected to learn from this content
-        11. application_context - Where or how this knowledge is applied (e.g., investing, health, education)
-        12. education_use_case - Tag for learning tasks (e.g., quiz_candidate, lesson_topic, glossary)
-        13. question_tags - Potential quiz or flashcard prompts (1-3 questions)
-        14. general_tags - List of {max_tags} general tags/keywords that describe the content
-
-        Format your response as a JSON object with each category as a key. Use arrays for lists and keep the format clean and consistent.
-        If a category is not applicable, use an empty array or appropriate default.
-        """
-        
-        # Prepare conversation for OpenAI
-        messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": f"Filename: {filename}\nFile type: {file_ext}\n\nContent for analysis: {text}"}
-        ]
-        
-        # Retry logic for API calls
-        retries = 0
-        last_error = None
-        
-        while retries <= max_retries:
+    text = _truncate_to_tokens(text)
+    
+    # Prepare conversation for OpenAI
+    messages = [
+        _METADATA_SYSTEM_MESSAGE,
+        {"role": "user", "content": _metadata_user_message(text, filename, file_ext, max_tags)}
+    ]
+    
+    def create():
+        response = _create_chat(
+            model=METADATA_MODEL,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=METADATA_MAX_TOKENS,
+            response_format=METADATA_RESPONSE_FORMAT,
+            max_attempts=max_retries + 1
+        )
+        if response.choices[0].finish_reason == "length":
+            logger.warning(f"Metadata response for {filename} was truncated at {METADATA_MAX_TOKENS} tokens")
+        return response.choices[0].message.content
+    
+    cache_key = _metadata_cache_key(text, filename, file_ext, max_tags)
+    
+    # Transient API errors are retried inside _create_chat
+    try:
+        metadata_response = llm_cache.get_or_set(cache_key, create) if cache else create()
+        
+        # The strict response schema guarantees the shape, so the JSON is used as is
+        metadata = _normalize_metadata(_json_loads(metadata_response), filename)
+        logger.debug(f"Generated comprehensive metadata with {len(metadata)} categories")
+        return metadata
+        
+    except Exception as e:
+        # With structured outputs an unparseable response means the API call went
+        # wrong (e.g. truncated output); don't serve it from the cache next time
+        if isinstance(e, json.JSONDecodeError):
+            llm_cache.delete(cache_key)
+        
+        # If it's an API key issue, say so
+        if is_fatal_error(e):
+            logger.error("OpenAI API key is invalid or missing")
+            default_metadata["error"] = "API key invalid"
+            return default_metadata
+        
+        logger.error(f"Failed to generate metadata: {e}")
+        default_metadata["error"] = str(e)
+        return default_metadata
+
+def _metadata_cache_key(text, filename, file_ext, max_tags):
+    """LLM cache key of a single-item metadata request (text already truncated)"""
+    return llm_cache.make_key(METADATA_MODEL, 0.3, [
+        _METADATA_SYSTEM_MESSAGE,
+        {"role": "user", "content": _metadata_user_message(text, filename, file_ext, max_tags)}
+    ])
+
+def _dedup_items(items):
+    """
+    Collapse metadata items with identical text
+    
+    Args:
+        items (list): Dicts with "text" and optionally "filename" and "file_ext"
+        
+    Returns:
+        tuple: (unique items, index into the unique items for each input item)
+    """
+    first_index = {}
+    unique_items, positions = [], []
+    for item in items:
+        key = hashlib.blake2b((item.get("text") or "").encode("utf-8"), digest_size=16).digest()
+        if key not in first_index:
+            first_index[key] = len(unique_items)
+            unique_items.append(item)
+        positions.append(first_index[key])
+    return unique_items, positions
+
+def _fan_out(unique_results, items, positions):
+    """Give each item a copy of its text's metadata, with its own source filename"""
+    results = []
+    for item, position in zip(items, positions):
+        metadata = {key: list(value) if isinstance(value, list) else value
+                    for key, value in unique_results[position].items()}
+        if "source_filename" in metadata and item.get("filename"):
+            metadata["source_filename"] = item["filename"]
+        results.append(metadata)
+    return results
+
+# Items per batched metadata request; each item can use up to METADATA_MAX_TOKENS output
+# tokens, so 20 items stay well inside the 16k output limit
+METADATA_BATCH_SIZE = int(os.environ.get("METADATA_BATCH_SIZE", 20))
+
+def generate_comprehensive_metadata_batch(items, max_tags=8, max_retries=3, batch_size=METADATA_BATCH_SIZE):
+    """
+    Generate comprehensive metadata for several texts with a single API request
+    
+    The texts are sent as numbered items in one prompt and the model returns a
+    list of results tagged with their item number, so N texts cost N / batch_size
+    round-trips instead of N, and the system prompt is sent once per batch.
+    
+    Args:
+        items (list): Dicts with "text" and optionally "filename" and "file_ext"
+        max_tags (int): Maximum number of general tags to generate per item
+        max_retries (int): Maximum number of retry attempts for API calls
+        batch_size (int): Maximum items per request
+        
+    Returns:
+        list: Metadata dicts in the same order as items (defaults for items that failed)
+    """
+    if not items:
+        return []
+    
+    # Boilerplate (headers, disclaimers, license text) repeats; analyze each text once
+    unique_items, positions = _dedup_items(items)
+    if len(unique_items) < len(items):
+        logger.debug(f"Generating metadata for {len(unique_items)} unique texts out of {len(items)}")
+        return _fan_out(generate_comprehensive_metadata_batch(
+            unique_items, max_tags=max_tags, max_retries=max_retries, batch_size=batch_size), items, positions)
+    
+    # Larger inputs are split into several batched requests
+    if len(items) > batch_size:
+        results = []
+        for start in range(0, len(items), batch_size):
+            results.extend(generate_comprehensive_metadata_batch(
+                items[start:start + batch_size], max_tags=max_tags, max_retries=max_retries, batch_size=batch_size))
+        return results
+    
+    # Check if client is available
+    if ensure_client() is None:
+        logger.error("OpenAI client not initialized - API key is missing")
+        return [{} for _ in items]
+    
+    results = [None] * len(items)
+    cache_keys = [None] * len(items)
+    sections = []
+    for index, item in enumerate(items):
+        text = item.get("text") or ""
+        if text.strip() == "":
+            # Nothing to analyze, don't spend tokens on it
+            results[index] = _default_metadata()
+            results[index]["chunk_summary"] = "Empty document"
+            continue
+        
+        if _is_low_content(text):
+            results[index] = _fragment_metadata(text, item.get("filename", ""), max_tags)
+            continue
+        
+        # Reuse metadata already generated for this text by a single-item request
+        # (or an earlier batch), e.g. when tags are requested after the metadata
+        text = _truncate_to_tokens(text)
+        cache_keys[index] = _metadata_cache_key(text, item.get("filename", ""), item.get("file_ext", ""), max_tags)
+        cached = llm_cache.cache.get(cache_keys[index]) if llm_cache.LLM_CACHE_ENABLED else None
+        if cached is not None:
             try:
-                # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-                # do not change this unless explicitly requested by the user
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    temperature=0.3,
-                    max_tokens=1000,
-                    response_format={"type": "json_object"}
-                )
-                
-                metadata_response = response.choices[0].message.content
-                
-                # Parse JSON response
-                try:
-                    metadata = json.loads(metadata_response)
-                    # Add source filename if provided
-                    if filename:
-                        metadata["source_filename"] = filename
-                    
-                    # Convert lists to string for compatibility with existing code where needed
-                    if isinstance(metadata.get("key_points"), list):
-                        metadata["key_points"] = "\n".join([f"• {point}" for point in metadata["key_points"]])
-                        
-                    if isinstance(metadata.get("concepts_covered"), list):
-                        metadata["concepts_covered"] = ", ".join(metadata["concepts_covered"])
-                        
-                    if isinstance(metadata.get("prerequisites"), list):
-                        metadata["prerequisites"] = ", ".join(metadata["prerequisites"])
-                        
-                    logger.debug(f"Generated comprehensive metadata with {len(metadata)} categories")
-                    return metadata
-                    
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse JSON response for metadata: {metadata_response}")
-                    retries += 1
-                    if retries > max_retries:
-                        logger.error("Max retries reached for JSON parsing")
-                        default_metadata["error"] = "JSON parse error"
-                        return default_metadata
-                    else:
-                        logger.info(f"Retrying after JSON parse error (attempt {retries}/{max_retries})")
-                        time.sleep(1)  # Brief pause before retry
-                
-            except Exception as e:
-                last_error = e
-                retries += 1
-                logger.warning(f"Error generating metadata (attempt {retries}/{max_retries}): {e}")
-                
-                # If it's an API key issue, don't retry
-                if "API key" in str(e):
-                    logger.error("OpenAI API key is invalid or missing")
-                    default_metadata["error"] = "API key invalid"
-                    return default_metadata
-                    
-                # If we've reached max retries, return default metadata
-                if retries > max_retries:
-                    logger.error(f"Failed to generate metadata after {max_retries} attempts: {e}")
-                    default_metadata["error"] = str(e)
-                    return default_metadata
-                    
-                # Wait with exponential backoff before retrying
-                wait_time = 2 ** (retries - 1)
-                logger.info(f"Waiting {wait_time}s before retrying metadata generation...")
-                time.sleep(wait_time)
+                results[index] = _normalize_metadata(_json_loads(cached), item.get("filename", ""))
+                continue
+            except json.JSONDecodeError:
+                llm_cache.delete(cache_keys[index])
+        
+        sections.append(
+            f"=== ITEM {index} ===\n"
+            f"Filename: {item.get('filename', '')}\nFile type: {item.get('file_ext', '')}\n\n"
+            f"Content for analysis: {text}"
+        )
+    
+    if not sections:
+        return results
+    
+    messages = [
+        _METADATA_BATCH_SYSTEM_MESSAGE,
+        {"role": "user", "content": f"Number of general_tags per item: {max_tags}\n\n" + "\n\n".join(sections)}
+    ]
+    
+    # Transient API errors are retried inside _create_chat
+    error = None
+    try:
+        response = _create_chat(
+            model=METADATA_MODEL,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=min(METADATA_MAX_TOKENS * len(sections), 16000),
+            response_format=METADATA_BATCH_RESPONSE_FORMAT,
+            max_attempts=max_retries + 1
+        )
+        if response.choices[0].finish_reason == "length":
+            logger.warning(f"Batched metadata response for {len(sections)} items was truncated")
+        
+        for entry in _json_loads(response.choices[0].message.content).get("results", []):
+            index = entry.pop("item", None)
+            if isinstance(index, int) and 0 <= index < len(items) and results[index] is None:
+                if llm_cache.LLM_CACHE_ENABLED and cache_keys[index] is not None:
+                    llm_cache.cache.set(cache_keys[index], json.dumps(entry), expire=llm_cache.LLM_CACHE_TTL)
+                results[index] = _normalize_metadata(entry, items[index].get("filename", ""))
+        
+        logger.debug(f"Generated comprehensive metadata for {len(sections)} items in one request")
+        
+    except Exception as e:
+        error = e
+        logger.error(f"Error generating batch metadata: {e}")
+    
+    # Items the model skipped (or all of them, if the request failed) get default metadata
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = _default_metadata()
+            results[index]["error"] = str(error) if error else "Missing from batch response"
+    
+    return results
 
 def generate_tags(text, max_tags=8, filename="", file_ext=""):
     """
-    Generate relevant tags for a text using OpenAI's GPT-4o model
+    Generate relevant tags for a text
+    
+    Tags are the general_tags of the comprehensive metadata, so they come from the
+    same (cached) request; asking for tags after the metadata costs no API call.
     
     Args:
-        text (str): Text to generate tags for
+        text (str or list): Text to generate tags for, or a list of texts to tag in one batched request
         max_tags (int): Maximum number of tags to generate
         filename (str): Original filename, if available
         file_ext (str): File extension/type, if available
         
     Returns:
-        list: List of tags
+        list: List of tags (a list of tag lists when text is a list)
     """
+    if isinstance(text, list):
+        metadata_list = generate_comprehensive_metadata_batch(
+            [{"text": item, "filename": filename, "file_ext": file_ext} for item in text],
+            max_tags=max_tags
+        )
+        return [metadata.get("general_tags", []) for metadata in metadata_list]
+    
     # For backward compatibility, use the comprehensive function but return just the tags
     metadata = generate_comprehensive_metadata(
         text=text,
@@ -197,7 +680,217 @@ def generate_tags(text, max_tags=8, filename="", file_ext=""):
     # Return general tags if available, otherwise empty list
     return metadata.get("general_tags", [])
 
-def generate_streaming_chat_response(query, search_results, max_retries=2):
+# Output token cap for chat answers. It follows the answers actually generated: 1.5x a
+# moving average of their length, kept between CHAT_MIN_MAX_TOKENS and CHAT_MAX_TOKENS,
+# starting at CHAT_DEFAULT_MAX_TOKENS. The cap is what rate limits reserve per request,
+# so reserving 1200 tokens for ~500-token answers wastes most of the TPM budget.
+CHAT_MAX_TOKENS = int(os.environ.get("CHAT_MAX_TOKENS", 1200))
+CHAT_MIN_MAX_TOKENS = int(os.environ.get("CHAT_MIN_MAX_TOKENS", 500))
+CHAT_DEFAULT_MAX_TOKENS = int(os.environ.get("CHAT_DEFAULT_MAX_TOKENS", 700))
+
+_answer_tokens_average = None
+_answer_tokens_lock = threading.Lock()
+
+def _chat_max_tokens():
+    """Return the max_tokens to request for the next chat answer"""
+    if _answer_tokens_average is None:
+        return CHAT_DEFAULT_MAX_TOKENS
+    return int(min(CHAT_MAX_TOKENS, max(CHAT_MIN_MAX_TOKENS, 1.5 * _answer_tokens_average)))
+
+def _record_answer_tokens(usage, max_tokens):
+    """
+    Update the answer length average from a response's usage
+    
+    An answer that used its whole allowance was probably cut off, so it counts as
+    CHAT_MAX_TOKENS long and the cap grows quickly.
+    """
+    global _answer_tokens_average
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if not completion_tokens:
+        return
+    
+    tokens = completion_tokens
+    if tokens >= max_tokens:
+        tokens = CHAT_MAX_TOKENS
+    with _answer_tokens_lock:
+        if _answer_tokens_average is None:
+            _answer_tokens_average = tokens
+        else:
+            _answer_tokens_average = 0.9 * _answer_tokens_average + 0.1 * tokens
+
+# Token budget for the retrieved context in a chat prompt. Prompt length drives time to
+# first token, so only the best-scoring chunks that fit are sent.
+CHAT_CONTEXT_MAX_TOKENS = int(os.environ.get("CHAT_CONTEXT_MAX_TOKENS", 6000))
+
+def _select_contexts(matches, max_tokens=CHAT_CONTEXT_MAX_TOKENS):
+    """
+    Pick the texts of the highest-scoring matches that fit in the token budget
+    
+    Args:
+        matches (list): Pinecone matches with metadata text
+        max_tokens (int): Token budget for all selected texts
+        
+    Returns:
+        list: Context texts, best match first
+    """
+    texts = [
+        match['metadata']['text']
+        for match in sorted(matches, key=lambda match: match.get('score') or 0, reverse=True)
+        if match.get('metadata') and match['metadata'].get('text')
+    ]
+    
+    contexts = []
+    remaining = max_tokens
+    for text in texts:
+        tokens = _count_tokens(text)
+        if tokens > remaining:
+            # Always keep (part of) the best match
+            if not contexts:
+                contexts.append(_truncate_to_tokens(text, remaining))
+            break
+        contexts.append(text)
+        remaining -= tokens
+    
+    if len(contexts) < len(texts):
+        logger.debug(f"Dropped {len(texts) - len(contexts)} of {len(texts)} context chunks over the {max_tokens}-token budget")
+    return contexts
+
+def _context_key(search_results):
+    """
+    Semantic cache key for the retrieved context: the ids of the matched chunks
+    
+    Returns None when nothing was retrieved (including a failed Pinecone query), so
+    an answer without context is never cached or served from the cache. A cached
+    answer only matches while the same chunks are retrieved, so newly uploaded
+    documents aren't hidden behind it.
+    """
+    ids = [match.get('id') for match in (search_results.get('matches') or ())]
+    return tuple(sorted(match_id for match_id in ids if match_id)) or None
+
+def _build_chat_messages(query, search_results):
+    """Build the chat prompt from the user's question and the retrieved document chunks"""
+    # Combine the context from search results, falling back to a generic note if none was found
+    combined_context = "\n\n---\n\n".join(
+        _select_contexts(search_results.get('matches') or ())
+    ) or "No specific information found in the documents."
+    
+    # Prepare conversation for OpenAI
+    messages = [
+        _CHAT_SYSTEM_MESSAGE,
+        {"role": "user", "content": f"Question: {query}\n\nContext from documents: {combined_context}"}
+    ]
+    return messages
+
+# Streamed tokens are sent to the client in groups: after this many tokens, or once
+# this many seconds have passed since the last event, whichever comes first
+STREAM_FLUSH_TOKENS = int(os.environ.get("STREAM_FLUSH_TOKENS", 20))
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL", 0.05))
+
+class _AnswerStream:
+    """
+    Turns the tokens of a streamed answer into the chunks sent to the client
+    
+    Only the new text is sent in each chunk, so the bytes sent grow linearly with the
+    answer instead of quadratically. Buttons are parsed incrementally: each scan
+    resumes where the last one stopped, and only runs when a tag may have been closed.
+    Shared by the sync and async streaming generators.
+    """
+    
+    def __init__(self):
+        self.full_response = ""
+        self.pending = []
+        self.keywords, self.follow_up_questions = [], []
+        self.search_pos = self.button_end = 0
+        self.last_yield = time.monotonic()
+        self.truncated = False  # The answer was cut off at max_tokens
+    
+    def start(self):
+        """Initial chunk with empty content at offset 0"""
+        return {
+            "token": "",
+            "offset": 0,
+            "status": "streaming",
+            "done": False
+        }
+    
+    def add(self, token):
+        """Add a token; return a chunk to send if one is due, otherwise None"""
+        self.full_response += token
+        self.pending.append(token)
+        
+        now = time.monotonic()
+        if len(self.pending) >= STREAM_FLUSH_TOKENS or now - self.last_yield >= STREAM_FLUSH_INTERVAL:
+            self.last_yield = now
+            return self.flush()
+        return None
+    
+    def flush(self):
+        """Build the chunk for the pending tokens and any buttons they closed"""
+        text = "".join(self.pending)
+        self.pending.clear()
+        event = {
+            "token": text,
+            "offset": len(self.full_response) - len(text),
+            "status": "streaming",
+            "done": False
+        }
+        
+        if ">" in text:
+            new_keywords, new_follow_ups, self.search_pos, self.button_end = _scan_closed_buttons(
+                self.full_response, self.search_pos, self.button_end
+            )
+            if new_keywords:
+                self.keywords.extend(new_keywords)
+                event["new_keywords"] = new_keywords
+            if new_follow_ups:
+                self.follow_up_questions.extend(new_follow_ups)
+                event["new_follow_up_questions"] = new_follow_ups
+        return event
+    
+    def complete(self):
+        """Final chunk with complete data"""
+        return _complete_event(self.result())
+    
+    def result(self):
+        """The answer in generate_chat_response's format"""
+        return {
+            "answer": self.full_response,
+            "keywords": self.keywords,
+            "follow_up_questions": self.follow_up_questions
+        }
+
+def _complete_event(response):
+    """Final streaming chunk for a finished (or cached) answer"""
+    return {
+        "token": "",
+        "status": "complete",
+        "full_answer": response["answer"],
+        "keywords": response["keywords"],
+        "follow_up_questions": response["follow_up_questions"],
+        "done": True
+    }
+
+def _stream_error_event(e):
+    """
+    Error chunk for a failed streaming request
+    """
+    # If it's an API key issue, say so
+    if is_fatal_error(e):
+        logger.error("OpenAI API key is invalid or missing")
+        return {
+            "answer": "<p>I apologize, but the OpenAI API key is invalid or missing. Please check your configuration.</p>",
+            "status": "error",
+            "done": True
+        }
+    
+    logger.error(f"Failed to generate streaming response: {e}")
+    return {
+        "answer": f"<p>I apologize, but I encountered an error: {str(e)}</p>",
+        "status": "error",
+        "done": True
+    }
+
+def generate_streaming_chat_response(query, search_results, max_retries=2, query_embedding=None, cache=llm_cache.LLM_CACHE_ENABLED):
     """
     Generate streaming context-aware responses using OpenAI's GPT-4o model
     
@@ -205,159 +898,86 @@ def generate_streaming_chat_response(query, search_results, max_retries=2):
         query (str): User's question
         search_results (dict): Results from Pinecone query
         max_retries (int): Maximum number of retry attempts for API calls
+        query_embedding (list): Embedding of the query; when given (and cache is on),
+            the answer to a near-identical earlier question with the same retrieved
+            context is replayed from the semantic cache
+        cache (bool): Use the semantic cache
         
     Yields:
-        dict: Streaming chunks of the response
+        dict: Streaming chunks of the response. Each "streaming" chunk carries the
+            new text as "token" (at most every STREAM_FLUSH_TOKENS tokens or
+            STREAM_FLUSH_INTERVAL seconds) and its "offset" in the answer; the
+            client appends them. Chunks in which a keyword or follow-up question
+            button was completed also carry "new_keywords" / "new_follow_up_questions",
+            so the UI can show them before the answer is finished. The final
+            "complete" chunk has the whole answer as "full_answer".
     """
-    global client, OPENAI_API_KEY
-    
     # Check if client is available
-    if client is None:
-        # Try to get API key again in case it was added after initialization
-        OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-        if OPENAI_API_KEY:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-        else:
-            logger.error("OpenAI client not initialized - API key is missing")
-            yield {
-                "answer": "<p>Error: OpenAI API key missing</p>",
-                "status": "error"
-            }
-            return
+    if ensure_client() is None:
+        logger.error("OpenAI client not initialized - API key is missing")
+        yield {
+            "answer": "<p>Error: OpenAI API key missing</p>",
+            "status": "error"
+        }
+        return
     
-    import time
+    context_key = _context_key(search_results)
+    use_semantic_cache = (cache and query_embedding is not None and context_key is not None
+                          and semantic_cache.chat_cache is not None)
+    if use_semantic_cache:
+        cached = semantic_cache.chat_cache.lookup(query_embedding, context=context_key)
+        if cached is not None:
+            yield _complete_event(cached)
+            return
     
     try:
-        # Extract context from search results
-        contexts = []
-        for match in search_results.get('matches', []):
-            if match.get('metadata') and match['metadata'].get('text'):
-                contexts.append(match['metadata']['text'])
-        
-        # If no contexts found, use a generic response
-        if not contexts:
-            contexts = ["No specific information found in the documents."]
-        
-        # Combine contexts
-        combined_context = "\n\n---\n\n".join(contexts)
-        
-        # Create system message with instructions
-        system_message = """
-        You are a witty, friendly educational assistant that explains complex concepts with clarity and humor.
-        Use metaphors and analogies to make concepts more understandable. Be conversational but educational.
-        Format your response in HTML. Identify key concepts that could be useful for further learning,
-        and format them as clickable buttons using HTML <button class="keyword">Concept</button> tags.
-        
-        Include 2-3 follow-up questions at the end of your response as buttons with the class "follow-up-question".
-        
-        For example: <button class="follow-up-question">Tell me more about X?</button>
-        
-        Format the response as follows:
-        1. Main answer with metaphors, analogies, and highlighted <button class="keyword">keywords</button>
-        2. A brief summary section (in a <div class="summary"></div>)
-        3. Follow-up questions (as buttons with class "follow-up-question")
-        """
-        
-        # Prepare conversation for OpenAI
-        messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": f"Question: {query}\n\nContext from documents: {combined_context}"}
-        ]
-        
-        # Retry logic
-        retries = 0
-        last_error = None
-        full_response = ""
-        
-        while retries <= max_retries:
-            try:
-                # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-                # do not change this unless explicitly requested by the user
-                stream = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=1200,
-                    stream=True
-                )
-                
-                # Initial chunk with empty content
-                yield {
-                    "token": "",
-                    "status": "streaming",
-                    "full_answer": "",
-                    "done": False
-                }
-                
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        token = chunk.choices[0].delta.content
-                        full_response += token
-                        
-                        # Send the token and the full response so far
-                        yield {
-                            "token": token,
-                            "status": "streaming",
-                            "full_answer": full_response,
-                            "done": False
-                        }
-                
-                # Stream complete - extract keywords and follow-up questions
-                keywords = re.findall(r'<button class="keyword">(.*?)</button>', full_response)
-                follow_up_questions = re.findall(r'<button class="follow-up-question">(.*?)</button>', full_response)
-                
-                # Final chunk with complete data
-                yield {
-                    "token": "",
-                    "status": "complete",
-                    "full_answer": full_response,
-                    "keywords": keywords,
-                    "follow_up_questions": follow_up_questions,
-                    "done": True
-                }
-                
-                # Break out of retry loop
-                break
-                
-            except Exception as e:
-                last_error = e
-                retries += 1
-                logger.warning(f"Error in streaming response (attempt {retries}/{max_retries}): {e}")
-                
-                # If it's an API key issue, don't retry
-                if "API key" in str(e):
-                    logger.error("OpenAI API key is invalid or missing")
-                    yield {
-                        "answer": "<p>I apologize, but the OpenAI API key is invalid or missing. Please check your configuration.</p>",
-                        "status": "error",
-                        "done": True
-                    }
-                    return
-                
-                # If we've reached max retries, return error response
-                if retries > max_retries:
-                    logger.error(f"Failed to generate streaming response after {max_retries} attempts: {e}")
-                    yield {
-                        "answer": f"<p>I apologize, but I encountered an error after multiple attempts: {str(e)}</p>",
-                        "status": "error",
-                        "done": True
-                    }
-                    return
-                
-                # Wait with exponential backoff before retrying
-                wait_time = 2 ** (retries - 1)
-                logger.info(f"Waiting {wait_time}s before retrying streaming response generation...")
-                time.sleep(wait_time)
+        # Build the prompt from the retrieved document chunks
+        messages = _build_chat_messages(query, search_results)
+        max_tokens = _chat_max_tokens()
+        
+        # Transient errors opening the stream are retried inside _create_chat; an
+        # error after that ends the answer with an error chunk
+        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+        # do not change this unless explicitly requested by the user
+        stream = _create_chat(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+            max_attempts=max_retries + 1
+        )
+        
+        answer = _AnswerStream()
+        yield answer.start()
+        
+        for chunk in stream:
+            # The final chunk carries token usage and no choices
+            if not chunk.choices:
+                _log_prompt_cache(chunk.usage)
+                _record_answer_tokens(chunk.usage, max_tokens)
+                continue
+            if chunk.choices[0].finish_reason == "length":
+                answer.truncated = True
+            if chunk.choices[0].delta.content is not None:
+                event = answer.add(chunk.choices[0].delta.content)
+                if event is not None:
+                    yield event
+        
+        if answer.pending:
+            yield answer.flush()
+        
+        # Stream complete - keywords and follow-up questions were collected above
+        yield answer.complete()
+        
+        # A truncated answer is served once but not cached
+        if use_semantic_cache and not answer.truncated:
+            semantic_cache.chat_cache.add(query_embedding, answer.result(), context=context_key)
                 
     except Exception as e:
-        logger.error(f"Error in streaming chat response: {e}")
-        yield {
-            "answer": f"<p>I apologize, but I encountered an error: {str(e)}</p>",
-            "status": "error",
-            "done": True
-        }
+        yield _stream_error_event(e)
 
-def generate_chat_response(query, search_results, max_retries=3):
+def generate_chat_response(query, search_results, max_retries=3, cache=llm_cache.LLM_CACHE_ENABLED, stream=False, query_embedding=None):
     """
     Generate context-aware responses using OpenAI's GPT-4o model
     
@@ -365,105 +985,100 @@ def generate_chat_response(query, search_results, max_retries=3):
         query (str): User's question
         search_results (dict): Results from Pinecone query
         max_retries (int): Maximum number of retry attempts for API calls
+        cache (bool): Reuse the answer for an identical earlier question and context
+        stream (bool): Return the generate_streaming_chat_response generator instead
+            (tokens and buttons as they arrive)
+        query_embedding (list): Embedding of the query; when given (and cache is on),
+            a near-identical earlier question's answer is returned from the semantic
+            cache if it was generated from the same retrieved chunks
         
     Returns:
         dict: Response with answer and metadata
     """
+    if stream:
+        return generate_streaming_chat_response(query, search_results, max_retries=max_retries, query_embedding=query_embedding, cache=cache)
+    
+    # Paraphrases of an earlier question over the same context are answered without a model call
+    context_key = _context_key(search_results)
+    use_semantic_cache = (cache and query_embedding is not None and context_key is not None
+                          and semantic_cache.chat_cache is not None)
+    if use_semantic_cache:
+        cached = semantic_cache.chat_cache.lookup(query_embedding, context=context_key)
+        if cached is not None:
+            return cached
+    
+    if ensure_client() is None:
+        logger.error("OpenAI client not initialized - API key is missing")
+        return {
+            "answer": "<p>I apologize, but the OpenAI API key is invalid or missing. Please check your configuration.</p>",
+            "keywords": [],
+            "follow_up_questions": []
+        }
+    
     try:
-        # Extract context from search results
-        contexts = []
-        for match in search_results.get('matches', []):
-            if match.get('metadata') and match['metadata'].get('text'):
-                contexts.append(match['metadata']['text'])
-        
-        # If no contexts found, use a generic response
-        if not contexts:
-            contexts = ["No specific information found in the documents."]
-        
-        # Combine contexts
-        combined_context = "\n\n---\n\n".join(contexts)
+        # Build the prompt from the retrieved document chunks
+        messages = _build_chat_messages(query, search_results)
+        truncated = False
         
-        # Create system message with instructions
-        system_message = """
-        You are a witty, friendly educational assistant that explains complex concepts with clarity and humor.
-        Use metaphors and analogies to make concepts more understandable. Be conversational but educational.
-        Format your response in HTML. Identify key concepts that could be useful for further learning,
-        and format them as clickable buttons using HTML <button class="keyword">Concept</button> tags.
+        def create():
+            nonlocal truncated
+            max_tokens = _chat_max_tokens()
+            # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+            # do not change this unless explicitly requested by the user
+            stream = _create_chat(
+                model="gpt-4o",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                stream=True,
+                max_attempts=max_retries + 1
+            )
+            
+            # Collect the streamed tokens; the connection stays active while the
+            # answer is generated instead of idling until the whole reply is ready
+            buf = []
+            for chunk in stream:
+                if not chunk.choices:
+                    _log_prompt_cache(chunk.usage)
+                    _record_answer_tokens(chunk.usage, max_tokens)
+                    continue
+                if chunk.choices[0].finish_reason == "length":
+                    truncated = True
+                if chunk.choices[0].delta.content:
+                    buf.append(chunk.choices[0].delta.content)
+            return "".join(buf)
         
-        Include 2-3 follow-up questions at the end of your response as buttons with the class "follow-up-question".
-        
-        For example: <button class="follow-up-question">Tell me more about X?</button>
-        
-        Format the response as follows:
-        1. Main answer with metaphors, analogies, and highlighted <button class="keyword">keywords</button>
-        2. A brief summary section (in a <div class="summary"></div>)
-        3. Follow-up questions (as buttons with class "follow-up-question")
-        """
-        
-        # Prepare conversation for OpenAI
-        messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": f"Question: {query}\n\nContext from documents: {combined_context}"}
-        ]
-        
-        import time
+        # Transient API errors are retried inside _create_chat
+        if cache:
+            # An answer cut off at max_tokens is returned but not cached
+            answer_html = llm_cache.get_or_set(
+                llm_cache.make_key("gpt-4o", 0.7, messages), create, cacheable=lambda _: not truncated
+            )
+        else:
+            answer_html = create()
         
-        # Retry logic for API calls
-        retries = 0
-        last_error = None
+        # Extract keywords and follow-up questions using regex
+        keywords, follow_up_questions = extract_buttons(answer_html)
         
-        while retries <= max_retries:
-            try:
-                # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-                # do not change this unless explicitly requested by the user
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=1200
-                )
-                
-                answer_html = response.choices[0].message.content
-                
-                # Extract keywords and follow-up questions using regex
-                keywords = re.findall(r'<button class="keyword">(.*?)</button>', answer_html)
-                follow_up_questions = re.findall(r'<button class="follow-up-question">(.*?)</button>', answer_html)
-                
-                return {
-                    "answer": answer_html,
-                    "keywords": keywords,
-                    "follow_up_questions": follow_up_questions
-                }
-                
-            except Exception as e:
-                last_error = e
-                retries += 1
-                logger.warning(f"Error generating chat response (attempt {retries}/{max_retries}): {e}")
-                
-                # If it's an API key issue, don't retry
-                if "API key" in str(e):
-                    logger.error("OpenAI API key is invalid or missing")
-                    return {
-                        "answer": "<p>I apologize, but the OpenAI API key is invalid or missing. Please check your configuration.</p>",
-                        "keywords": [],
-                        "follow_up_questions": []
-                    }
-                
-                # If we've reached max retries, return error response
-                if retries > max_retries:
-                    logger.error(f"Failed to generate chat response after {max_retries} attempts: {e}")
-                    return {
-                        "answer": f"<p>I apologize, but I encountered an error after multiple attempts: {str(e)}</p>",
-                        "keywords": [],
-                        "follow_up_questions": []
-                    }
-                
-                # Wait with exponential backoff before retrying
-                wait_time = 2 ** (retries - 1)
-                logger.info(f"Waiting {wait_time}s before retrying chat response generation...")
-                time.sleep(wait_time)
+        response = {
+            "answer": answer_html,
+            "keywords": keywords,
+            "follow_up_questions": follow_up_questions
+        }
+        if use_semantic_cache and not truncated:
+            semantic_cache.chat_cache.add(query_embedding, response, context=context_key)
+        return response
     
     except Exception as e:
+        # If it's an API key issue, say so
+        if is_fatal_error(e):
+            logger.error("OpenAI API key is invalid or missing")
+            return {
+                "answer": "<p>I apologize, but the OpenAI API key is invalid or missing. Please check your configuration.</p>",
+                "keywords": [],
+                "follow_up_questions": []
+            }
+        
         logger.error(f"Error generating chat response: {e}")
         return {
             "answer": f"<p>I apologize, but I encountered an error: {str(e)}</p>",
@@ -1,6 +1,13 @@
 import os
+import array
+import hashlib
 import logging
-from openai import OpenAI
+import sqlite3
+import threading
+from utils.openai_client import get_client
+from utils.rate_limit import retry_with_backoff, is_fatal_error
+from utils.llm_cache import MemoryCache
+from utils import semantic_cache
 
 logger = logging.getLogger(__name__)
 
@@ -9,76 +16,324 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 client = None
 
 if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = get_client(OPENAI_API_KEY)
 else:
     logger.warning("OPENAI_API_KEY not set in environment variables")
     # Client will be initialized later when the key is available
 
+_client_lock = threading.Lock()
+
+def _get_client():
+    """
+    Get the module's OpenAI client, creating it once the API key is available
+    
+    Double-checked under a lock so concurrent first calls share one client.
+    
+    Returns:
+        OpenAI: Shared client, or None if no API key is set
+    """
+    global client, OPENAI_API_KEY
+    if client is not None:
+        return client
+    with _client_lock:
+        if client is None:
+            OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+            if OPENAI_API_KEY:
+                client = get_client(OPENAI_API_KEY)
+    return client
+
+# Embedding model and output dimension. text-embedding-3-* models accept a reduced
+# `dimensions` (e.g. 512 or 1024) with little retrieval loss; ada-002 is fixed at 1536.
+# The Pinecone index must be created with the same dimension.
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBED_DIMS", "1536"))
+
+# Inputs longer than this many characters are truncated (the model has a token limit)
+EMBEDDING_MAX_CHARS = int(os.environ.get("EMBEDDING_MAX_CHARS", 8000))
+
+# Request parameters shared by every embeddings call; only the input varies.
+# Only the text-embedding-3 models support shortened embeddings.
+_REQUEST_PARAMS = {"model": EMBEDDING_MODEL}
+if EMBEDDING_MODEL.startswith("text-embedding-3"):
+    _REQUEST_PARAMS["dimensions"] = EMBEDDING_DIMENSIONS
+
+# Embeddings are cached by text hash, so re-ingested documents and repeated chunks don't
+# cost another request. The persistent store is a diskcache.Cache when installed,
+# otherwise an SQLite database in the same directory; vectors are stored as float32
+# bytes (4 bytes per dimension). Recently used vectors are also kept in memory.
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "./.embed_cache")
+EMBEDDING_CACHE_SIZE_LIMIT = int(os.environ.get("EMBEDDING_CACHE_SIZE_LIMIT", 2 * 1024 ** 3))
+EMBEDDING_MEMORY_CACHE_SIZE = int(os.environ.get("EMBEDDING_MEMORY_CACHE_SIZE", 4096))
+
+# On an exact miss, reuse the embedding of a recently embedded text that is nearly
+# identical (e.g. a chunk with a whitespace edit or typo fix); needs numpy
+EMBEDDING_FUZZY_CACHE = os.environ.get("EMBEDDING_FUZZY_CACHE", "true").lower() == "true"
+EMBEDDING_FUZZY_THRESHOLD = float(os.environ.get("EMBEDDING_FUZZY_THRESHOLD", 0.95))
+EMBEDDING_FUZZY_CACHE_SIZE = int(os.environ.get("EMBEDDING_FUZZY_CACHE_SIZE", 2048))
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+class SqliteCache:
+    """
+    Persistent key/bytes store in an SQLite database
+    
+    Offers the get/set subset of diskcache.Cache used here. Safe to share between
+    threads; WAL mode lets several processes read while one writes.
+    """
+    
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB)")
+        self.lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+    
+    def set(self, key, value, expire=None):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, value))
+        return True
+
+
+def _create_cache():
+    """Open the persistent embedding cache, or return None if it is disabled or unavailable"""
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    try:
+        if diskcache is not None:
+            return diskcache.Cache(EMBEDDING_CACHE_DIR, size_limit=EMBEDDING_CACHE_SIZE_LIMIT)
+        os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+        return SqliteCache(os.path.join(EMBEDDING_CACHE_DIR, "embeddings.sqlite3"))
+    except Exception as e:
+        logger.warning(f"Could not open embedding cache at {EMBEDDING_CACHE_DIR}, using memory only: {e}")
+        return None
+
+_cache = _create_cache()
+_memory_cache = MemoryCache(max_entries=EMBEDDING_MEMORY_CACHE_SIZE) if EMBEDDING_CACHE_ENABLED else None
+_fuzzy_cache = None
+if EMBEDDING_CACHE_ENABLED and EMBEDDING_FUZZY_CACHE and semantic_cache.np is not None:
+    _fuzzy_cache = semantic_cache.NearDuplicateCache(
+        threshold=EMBEDDING_FUZZY_THRESHOLD,
+        max_entries=EMBEDDING_FUZZY_CACHE_SIZE
+    )
+
+def _pack(embedding):
+    """Serialize an embedding as float32 bytes"""
+    return array.array("f", embedding).tobytes()
+
+def _unpack(value):
+    """Deserialize a stored embedding (float32 bytes, or a list from older cache entries)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        vector = array.array("f")
+        vector.frombytes(value)
+        return vector.tolist()
+    return value
+
+def _cache_key(text):
+    """Cache key for a prepared text under the current model and dimensions"""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    return f"{digest}:{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}"
+
+def _cache_get(text):
+    """
+    Look up the cached embedding for a prepared text
+    
+    Returns:
+        tuple: (embedding or None, near-duplicate sketch or None). The sketch is
+            computed for a fuzzy lookup and is passed back to _cache_set, so a new
+            text is only shingled and hashed once.
+    """
+    if _memory_cache is None:
+        return None, None
+    key = _cache_key(text)
+    embedding = _memory_cache.get(key)
+    if embedding is None and _cache is not None:
+        value = _cache.get(key)
+        if value is not None:
+            embedding = _unpack(value)
+            _memory_cache.set(key, embedding)
+    sketch = None
+    if embedding is None and _fuzzy_cache is not None:
+        sketch = _fuzzy_cache.sketch(text)
+        embedding = _fuzzy_cache.get(text, sketch=sketch)
+    return embedding, sketch
+
+def _cache_set(text, embedding, sketch=None):
+    """Store the embedding for a prepared text, reusing its sketch from _cache_get"""
+    if _memory_cache is None or not embedding:
+        return
+    key = _cache_key(text)
+    _memory_cache.set(key, embedding)
+    if _cache is not None:
+        _cache.set(key, _pack(embedding))
+    if _fuzzy_cache is not None:
+        _fuzzy_cache.set(text, embedding, sketch=sketch)
+
+# Quantize stored vectors to int8 levels before upserting (see quantize_embedding)
+QUANTIZE_EMBEDDINGS = os.environ.get("QUANTIZE_EMBEDDINGS", "true").lower() == "true"
+
+
+def quantize_embedding(embedding):
+    """
+    Quantize an embedding to int8 levels using per-vector max-abs scaling
+    
+    Values are rounded to integers in [-127, 127] and returned as floats, since
+    Pinecone only accepts float lists. Cosine similarity is scale invariant, so
+    the vectors stay comparable with unquantized query vectors while the JSON
+    payload shrinks to a few bytes per dimension.
+    
+    Args:
+        embedding (list): Vector embedding
+        
+    Returns:
+        list: Quantized vector embedding (unchanged if quantization is disabled)
+    """
+    if not QUANTIZE_EMBEDDINGS or not embedding:
+        return embedding
+    
+    scale = max(abs(value) for value in embedding)
+    if scale == 0:
+        return embedding
+    
+    factor = 127 / scale
+    return [float(round(value * factor)) for value in embedding]
+
+def _prepare_text(text):
+    """Replace empty input with a placeholder and truncate to the model's input limit"""
+    if not text or text.strip() == "":
+        logger.warning("Empty text provided for embedding generation, using placeholder")
+        return "empty_document_placeholder"
+    
+    # Truncate if text is too long (the model has a token limit)
+    if len(text) > EMBEDDING_MAX_CHARS:
+        logger.warning(f"Text too long ({len(text)} chars), truncating to {EMBEDDING_MAX_CHARS} chars")
+        return text[:EMBEDDING_MAX_CHARS]
+    
+    return text
+
+def _group_misses(inputs, misses):
+    """
+    Group uncached inputs that only differ in whitespace or case
+    
+    Repeated chunks (chapter headers, page footers, legal notices) are then
+    embedded once and the result is shared by every occurrence.
+    
+    Returns:
+        list: Lists of input indexes; the first index of each group is sent
+    """
+    groups = {}
+    for i in misses:
+        groups.setdefault(" ".join(inputs[i].split()).lower(), []).append(i)
+    return list(groups.values())
+
 def generate_embeddings(text, max_retries=3):
     """
-    Generate embeddings for text using OpenAI's text-embedding-ada-002 model
+    Generate embeddings for text using the configured OpenAI embedding model
     
     Args:
         text (str): Text to generate embeddings for
-        max_retries (int): Maximum number of retry attempts for API calls
+        max_retries (int): Maximum retries for rate limits, timeouts and server errors
         
     Returns:
         list: Vector embeddings
     """
-    import time
-    global client, OPENAI_API_KEY
-    
     # Check if client is available
-    if client is None:
-        # Try to get API key again in case it was added after initialization
-        OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-        if OPENAI_API_KEY:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-        else:
-            logger.error("OpenAI client not initialized - API key is missing")
-            raise ValueError("OpenAI API key is required for generating embeddings")
+    if _get_client() is None:
+        logger.error("OpenAI client not initialized - API key is missing")
+        raise ValueError("OpenAI API key is required for generating embeddings")
     
     # Clean and prepare text
-    if not text or text.strip() == "":
-        logger.warning("Empty text provided for embedding generation, using placeholder")
-        text = "empty_document_placeholder"
+    text = _prepare_text(text)
     
-    # Truncate if text is too long (the model has a token limit)
-    if len(text) > 8000:
-        logger.warning(f"Text too long ({len(text)} chars), truncating to 8000 chars")
-        text = text[:8000]
-    
-    # Retry logic
-    retries = 0
-    last_error = None
-    
-    while retries <= max_retries:
-        try:
-            response = client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
-            )
-            
-            # Extract the embedding vector
-            embedding = response.data[0].embedding
-            return embedding
-            
-        except Exception as e:
-            last_error = e
-            retries += 1
-            logger.warning(f"Error generating embeddings (attempt {retries}/{max_retries}): {e}")
-            
-            # If it's an API key issue, raise immediately
-            if "API key" in str(e):
-                logger.error("OpenAI API key is invalid or missing")
-                raise ValueError("OpenAI API key is invalid or missing")
-                
-            # If we've reached max retries, raise the error
-            if retries > max_retries:
-                logger.error(f"Failed to generate embeddings after {max_retries} attempts: {e}")
-                raise
-                
-            # Wait with exponential backoff before retrying (1s, 2s, 4s, etc.)
-            wait_time = 2 ** (retries - 1)
-            logger.info(f"Waiting {wait_time}s before retrying...")
-            time.sleep(wait_time)
+    cached, sketch = _cache_get(text)
+    if cached is not None:
+        return cached
+    
+    # Transient errors (rate limits, timeouts, 5xx) are retried inside retry_with_backoff
+    # with jittered backoff; anything else fails straight away
+    try:
+        response = retry_with_backoff(
+            lambda: client.embeddings.create(input=text, **_REQUEST_PARAMS),
+            max_attempts=max_retries + 1
+        )
+    except Exception as e:
+        # If it's an API key issue, say so
+        if is_fatal_error(e):
+            logger.error("OpenAI API key is invalid or missing")
+            raise ValueError("OpenAI API key is invalid or missing") from e
+        logger.error(f"Failed to generate embeddings: {e}")
+        raise
+    
+    # Extract the embedding vector
+    embedding = response.data[0].embedding
+    _cache_set(text, embedding, sketch)
+    return embedding
+
+def generate_embeddings_batch(texts, max_retries=3):
+    """
+    Generate embeddings for several texts with a single API request
+    
+    The embeddings endpoint accepts a list input (up to 2048 items), so a whole
+    batch of chunks costs one round-trip instead of one per chunk.
+    
+    Args:
+        texts (list): Texts to generate embeddings for
+        max_retries (int): Maximum retries for rate limits, timeouts and server errors
+        
+    Returns:
+        list: Vector embeddings, in the same order as texts
+        
+    Raises:
+        BadRequestError: If the API rejects the batch (e.g. an oversized input);
+            callers can fall back to generate_embeddings per text
+    """
+    if not texts:
+        return []
+    
+    # Check if client is available
+    if _get_client() is None:
+        logger.error("OpenAI client not initialized - API key is missing")
+        raise ValueError("OpenAI API key is required for generating embeddings")
+    
+    # Clean and prepare texts
+    inputs = [_prepare_text(text) for text in texts]
+    
+    # Only texts without a cached embedding are sent
+    lookups = [_cache_get(text) for text in inputs]
+    embeddings = [embedding for embedding, _ in lookups]
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not misses:
+        return embeddings
+    groups = _group_misses(inputs, misses)
+    
+    # Transient errors are retried inside retry_with_backoff; a rejected batch
+    # (BadRequestError, e.g. an oversized input) is raised for the caller to split
+    miss_inputs = [inputs[group[0]] for group in groups]
+    try:
+        response = retry_with_backoff(
+            lambda: client.embeddings.create(input=miss_inputs, **_REQUEST_PARAMS),
+            max_attempts=max_retries + 1
+        )
+    except Exception as e:
+        # If it's an API key issue, say so
+        if is_fatal_error(e):
+            logger.error("OpenAI API key is invalid or missing")
+            raise ValueError("OpenAI API key is invalid or missing") from e
+        logger.error(f"Failed to generate batch embeddings: {e}")
+        raise
+    
+    # Results carry their input index; sort to guarantee input order
+    for group, item in zip(groups, sorted(response.data, key=lambda item: item.index)):
+        for i in group:
+            embeddings[i] = item.embedding
+            _cache_set(inputs[i], item.embedding, lookups[i][1])
+    return embeddings
@@ -2,16 +2,68 @@ import os
 import logging
 import tempfile
 import subprocess
-import fitz  # PyMuPDF
-import ebooklib
-from ebooklib import epub
-import chardet
-import tiktoken
+import array
+import contextlib
+import functools
+import itertools
+import hashlib
 import shutil
 import re
+import threading
+from utils.llm_cache import MemoryCache
 
 logger = logging.getLogger(__name__)
 
+# selectolax parses EPUB HTML in C and handles entities and scripts; fall back to
+# stripping tags with a regex if it isn't installed
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+# Patterns used per EPUB document / per binary string; compile them once
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+# A whole run of printable ASCII, more than 10 bytes long, containing sentence punctuation.
+# The lookbehind anchors matches at the start of a run and the lookahead checks the
+# punctuation, so runs that aren't natural language are never turned into objects.
+_SENTENCE_RUN_RE = re.compile(rb'(?<![\x20-\x7E\n\r\t])(?=[\x20-\x7E\n\r\t]*[.!?])[\x20-\x7E\n\r\t]{11,}')
+
+# "pymupdf" (default) or "pdfium"; pypdfium2 can be faster with less memory per page
+# for plain text on some corpora. Falls back to PyMuPDF if pypdfium2 isn't installed.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "pymupdf").lower()
+
+# PDFs with at least this many pages are read page by page straight into the chunker
+# (open_pdf_stream / iter_pdf_chunks) instead of being extracted to one string first,
+# so their whole text is never held in memory. 0 disables streaming.
+PDF_STREAM_MIN_PAGES = int(os.environ.get("PDF_STREAM_MIN_PAGES", 300))
+
+# Characters of a streamed PDF's first pages kept for the metadata sample
+PDF_STREAM_SAMPLE_CHARS = 20000
+
+# PyMuPDF isn't thread-safe; streamed PDFs are read from the file worker threads,
+# so every document open, page read and close takes this lock
+_pdf_lock = threading.Lock()
+
+# Bytes of a text file used to detect its encoding
+TXT_SNIFF_BYTES = 64 * 1024
+
+# Calibre's converter for Kindle formats, looked up once instead of run per file to test for it
+_HAS_EBOOK_CONVERT = shutil.which("ebook-convert") is not None
+
+# The parsing libraries (PyMuPDF, ebooklib, chardet, tiktoken) are imported inside the
+# functions that use them, so processes that only query don't pay for loading them
+
+@functools.lru_cache(maxsize=None)
+def _pdf_text_flags():
+    """Plain-text extraction flags without image blocks; older PyMuPDF releases lack the
+    named constants and use their own defaults instead"""
+    import fitz  # PyMuPDF
+    return (fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES) if hasattr(fitz, "TEXTFLAGS_TEXT") else None
+
+def _page_text(page):
+    """Extract the plain text of a PDF page"""
+    return page.get_text("text", flags=_pdf_text_flags(), sort=False)
+
 def extract_text_from_file(filepath, file_ext):
     """
     Extract text content from various file formats
@@ -39,35 +91,141 @@ def extract_text_from_file(filepath, file_ext):
         logger.error(f"Error extracting text from {filepath}: {e}")
         return None
 
+def extract_from_pdf_pdfium(filepath):
+    """Extract text from PDF using pypdfium2"""
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(filepath)
+    try:
+        parts = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "".join(parts)
+    finally:
+        pdf.close()
+
 def extract_from_pdf(filepath):
-    """Extract text from PDF using PyMuPDF"""
-    text = ""
+    """Extract text from PDF using PyMuPDF, or pypdfium2 when PDF_BACKEND is pdfium"""
+    if PDF_BACKEND == "pdfium":
+        try:
+            return extract_from_pdf_pdfium(filepath)
+        except ImportError:
+            logger.warning("pypdfium2 not installed, using PyMuPDF")
+        except Exception as e:
+            logger.error(f"Error extracting PDF: {e}")
+            raise
+    
     try:
-        with fitz.open(filepath) as doc:
-            for page in doc:
-                text += page.get_text()
-        return text
+        import fitz  # PyMuPDF
+        # PyMuPDF isn't thread-safe, so pages are read in one pass on this thread;
+        # the folder processor already extracts files in parallel worker processes
+        with _pdf_lock, fitz.open(filepath) as doc:
+            return "".join(_page_text(page) for page in doc)
     except Exception as e:
         logger.error(f"Error extracting PDF: {e}")
         raise
 
+class PdfStream:
+    """
+    A PDF being read page by page, see open_pdf_stream
+    
+    Attributes:
+        head_text (str): Text of the first pages, for the metadata sample
+        pages: Iterator over every page's text, the first pages included
+        page_count (int): Number of pages in the document
+        head_pages (int): Number of pages in head_text
+    """
+    def __init__(self, head_text, pages, page_count, head_pages):
+        self.head_text = head_text
+        self.pages = pages
+        self.page_count = page_count
+        self.head_pages = head_pages
+    
+    def estimated_chars(self):
+        """Estimate the document's length from the first pages, for progress reporting"""
+        return len(self.head_text) * self.page_count // max(1, self.head_pages)
+
+def should_stream_pdf(filepath):
+    """Whether a PDF is long enough to be chunked page by page (PDF_STREAM_MIN_PAGES)"""
+    if not PDF_STREAM_MIN_PAGES or PDF_BACKEND == "pdfium":
+        return False
+    try:
+        import fitz  # PyMuPDF
+        with _pdf_lock, fitz.open(filepath) as doc:
+            return doc.page_count >= PDF_STREAM_MIN_PAGES
+    except Exception as e:
+        logger.warning(f"Could not read page count of {filepath}, extracting it whole: {e}")
+        return False
+
+def _iter_pdf_pages(doc):
+    """Yield each page's text, holding the PyMuPDF lock only while a page is read"""
+    try:
+        for page_number in range(doc.page_count):
+            with _pdf_lock:
+                text = _page_text(doc[page_number])
+            yield text
+    finally:
+        with _pdf_lock:
+            doc.close()
+
+def open_pdf_stream(filepath, sample_chars=PDF_STREAM_SAMPLE_CHARS):
+    """
+    Open a PDF for page-by-page chunking
+    
+    The first pages are read until sample_chars characters are collected (or the
+    document ends); the rest are only read as the returned stream is consumed.
+    
+    Args:
+        filepath (str): Path to the PDF
+        sample_chars (int): Characters of the first pages to keep in head_text
+        
+    Returns:
+        PdfStream: The opened document
+    """
+    import fitz  # PyMuPDF
+    with _pdf_lock:
+        doc = fitz.open(filepath)
+    pages = _iter_pdf_pages(doc)
+    head = []
+    head_chars = 0
+    for text in pages:
+        head.append(text)
+        head_chars += len(text)
+        if head_chars >= sample_chars:
+            break
+    return PdfStream("".join(head), itertools.chain(head, pages), doc.page_count, len(head))
+
+def _strip_html_tags(content):
+    """Simple HTML tag removal, used when selectolax is missing or fails to parse"""
+    content = content.replace('<p>', '\n').replace('</p>', '\n')
+    content = content.replace('<br>', '\n').replace('<br/>', '\n')
+    # Remove other HTML tags
+    return _HTML_TAG_RE.sub('', content)
+
+def _html_to_text(content):
+    """Convert one EPUB document's HTML to plain text"""
+    if HTMLParser is not None:
+        try:
+            tree = HTMLParser(content)
+            tree.strip_tags(["script", "style"])
+            return tree.text(separator="\n")
+        except Exception as e:
+            logger.warning(f"HTML parsing failed, stripping tags instead: {e}")
+    return _strip_html_tags(content)
+
 def extract_from_epub(filepath):
     """Extract text from EPUB using ebooklib"""
-    text = ""
     try:
+        import ebooklib
+        from ebooklib import epub
         book = epub.read_epub(filepath)
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                content = item.get_content()
-                # Simple HTML tags removal - for production use a proper HTML parser
-                content = content.decode('utf-8')
-                content = content.replace('<p>', '\n').replace('</p>', '\n')
-                content = content.replace('<br>', '\n').replace('<br/>', '\n')
-                # Remove other HTML tags
-                import re
-                content = re.sub(r'<[^>]+>', '', content)
-                text += content
-        return text
+        return "".join(
+            _html_to_text(item.get_content().decode('utf-8'))
+            for item in book.get_items()
+            if item.get_type() == ebooklib.ITEM_DOCUMENT
+        )
     except Exception as e:
         logger.error(f"Error extracting EPUB: {e}")
         raise
@@ -75,12 +233,16 @@ def extract_from_epub(filepath):
 def extract_from_txt(filepath):
     """Extract text from TXT using chardet for encoding detection"""
     try:
+        import chardet
+        # Detect the encoding from the start of the file only, so detection cost
+        # doesn't grow with the file and the raw bytes aren't held alongside the text
         with open(filepath, 'rb') as file:
-            raw_data = file.read()
-            result = chardet.detect(raw_data)
-            encoding = result['encoding']
+            result = chardet.detect(file.read(TXT_SNIFF_BYTES))
+            encoding = result['encoding'] or 'utf-8'
         
-        with open(filepath, 'r', encoding=encoding) as file:
+        # A guess from the prefix can miss rare characters later on; replace those
+        # rather than failing the whole file
+        with open(filepath, 'r', encoding=encoding, errors='replace') as file:
             return file.read()
     except Exception as e:
         logger.error(f"Error extracting TXT: {e}")
@@ -93,31 +255,31 @@ def extract_from_kindle(filepath, file_ext):
     """
     try:
         # Try with ebook-convert (if Calibre is installed)
-        temp_output = os.path.join(tempfile.gettempdir(), f"output_{os.path.basename(filepath)}.txt")
-        
         try:
             # Check if ebook-convert is available
-            subprocess.run(['ebook-convert', '--version'], 
-                           stdout=subprocess.PIPE, 
-                           stderr=subprocess.PIPE, 
-                           check=True)
+            if not _HAS_EBOOK_CONVERT:
+                raise FileNotFoundError("ebook-convert not found on PATH")
             
-            # Use ebook-convert to convert to text
-            subprocess.run([
-                'ebook-convert', 
-                filepath, 
-                temp_output
-            ], check=True)
+            # A unique output path per call, so concurrent conversions of files
+            # with the same name can't overwrite each other's output
+            with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as temp_file:
+                temp_output = temp_file.name
             
-            # Read the converted text file
-            with open(temp_output, 'r', encoding='utf-8') as f:
-                text = f.read()
-                
-            # Clean up temp file
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
+            try:
+                # Use ebook-convert to convert to text
+                subprocess.run([
+                    'ebook-convert', 
+                    filepath, 
+                    temp_output
+                ], check=True)
                 
-            return text
+                # Read the converted text file
+                with open(temp_output, 'r', encoding='utf-8') as f:
+                    return f.read()
+            finally:
+                # Clean up temp file, also when the conversion failed
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(temp_output)
         
         except (subprocess.CalledProcessError, FileNotFoundError):
             logger.warning("ebook-convert not available, falling back to simple text extraction")
@@ -130,22 +292,13 @@ def extract_from_kindle(filepath, file_ext):
                 with open(filepath, 'rb') as f:
                     content = f.read()
                 
-                # Extract ASCII/UTF-8 strings from binary content
-                text = ""
+                # Extract sequences of printable ASCII characters from the binary
+                # content, skipping ones that are likely not natural language
+                text = "".join(
+                    match.group().decode('ascii') + "\n\n"
+                    for match in _SENTENCE_RUN_RE.finditer(content)
+                )
                 
-                # Simple pattern to extract text (ASCII/UTF-8 sequences)
-                # Look for sequences of printable ASCII characters
-                printable_chars = re.findall(rb'[\x20-\x7E\n\r\t]{4,}', content)
-                
-                for chars in printable_chars:
-                    try:
-                        decoded = chars.decode('utf-8', errors='ignore')
-                        # Skip strings that are likely not natural language
-                        if len(decoded) > 10 and re.search(r'[.!?]', decoded):
-                            text += decoded + "\n\n"
-                    except UnicodeDecodeError:
-                        pass
-                        
                 if text:
                     return text
                 else:
@@ -161,38 +314,141 @@ def extract_from_kindle(filepath, file_ext):
         logger.error(f"Error extracting Kindle format: {e}")
         raise
 
-def chunk_text(text, max_tokens=500):
+# Chunks decoded per tokenizer call in iter_chunks; matches the embedding batch size
+DECODE_BATCH_CHUNKS = 64
+
+# Token arrays of recently chunked texts, so re-chunking a document (e.g. a retried
+# upload) skips the encode. Stored as 4-byte ints rather than Python int objects.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 8))
+_token_cache = MemoryCache(max_entries=TOKEN_CACHE_SIZE)
+
+_encoding = None
+
+def _get_encoding():
+    """Return the chunking tokenizer (gpt-4's cl100k_base), loaded on first use and reused"""
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+def _encode_cached(enc, text):
+    """Tokenize text, reusing the tokens of an identical text chunked recently"""
+    key = hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+    tokens = _token_cache.get(key)
+    if tokens is None:
+        tokens = array.array('i', enc.encode(text))
+        _token_cache.set(key, tokens)
+    return tokens
+
+def iter_chunks(text, max_tokens=500):
     """
-    Chunk text into segments of approximately max_tokens each
+    Lazily chunk text into segments of approximately max_tokens each
+    
+    Chunks are decoded one at a time as the caller consumes them, so the
+    first chunk can be embedded before the rest of the text is chunked.
     
     Args:
         text (str): Text to be chunked
         max_tokens (int): Maximum tokens per chunk
         
-    Returns:
-        list: List of text chunks
+    Yields:
+        str: Text chunks
     """
     try:
-        # Initialize GPT tokenizer
-        enc = tiktoken.encoding_for_model("gpt-4")
+        # GPT tokenizer, shared across calls
+        enc = _get_encoding()
         
         # Tokenize text
-        tokens = enc.encode(text)
-        chunks = []
+        tokens = _encode_cached(enc, text)
+    except Exception as e:
+        logger.error(f"Error chunking text: {e}")
+        # Fallback to simple character-based chunking if tokenization fails
+        for i in range(0, len(text), 2000):
+            yield text[i:i + 2000]
+        return
+    
+    # Check if text is short enough for a single chunk
+    if len(tokens) <= max_tokens:
+        yield text
+        return
+    
+    # Only the tokens are needed from here on; drop the reference so the text
+    # can be freed if the caller has let go of it too
+    del text
+    
+    # Decode a group of chunks per decode_batch call rather than one call per
+    # chunk; groups keep the first chunks available before the rest are decoded
+    group_tokens = max_tokens * DECODE_BATCH_CHUNKS
+    for start in range(0, len(tokens), group_tokens):
+        stop = min(start + group_tokens, len(tokens))
+        yield from enc.decode_batch([tokens[i:i + max_tokens].tolist() for i in range(start, stop, max_tokens)])
+
+def _chunk_token_stream(segments, enc, max_tokens):
+    """
+    Encode text segments one at a time and yield max_tokens-sized chunks
+    
+    Only the tokens not yet emitted are kept, so memory stays proportional to one
+    segment rather than the whole text. Chunks may span segment boundaries.
+    """
+    buffer = []
+    for segment in segments:
+        buffer.extend(enc.encode(segment))
+        start = 0
+        while len(buffer) - start >= max_tokens:
+            yield enc.decode(buffer[start:start + max_tokens])
+            start += max_tokens
+        del buffer[:start]
+    if buffer:
+        yield enc.decode(buffer)
+
+def iter_pdf_chunks(pages, max_tokens=500):
+    """
+    Lazily chunk a PDF's page texts into segments of approximately max_tokens each
+    
+    Pages are tokenized as they arrive, so a long document is chunked without
+    joining its text into one string first.
+    
+    Args:
+        pages: Iterable of page texts, e.g. PdfStream.pages
+        max_tokens (int): Maximum tokens per chunk
         
-        # Check if text is short enough for a single chunk
-        if len(tokens) <= max_tokens:
-            return [text]
+    Yields:
+        str: Text chunks
+    """
+    yield from _chunk_token_stream(pages, _get_encoding(), max_tokens)
+
+def chunk_text(text, max_tokens=500):
+    """
+    Chunk text into segments of approximately max_tokens each
+    
+    Args:
+        text (str): Text to be chunked
+        max_tokens (int): Maximum tokens per chunk
         
-        # Process text into chunks
-        for i in range(0, len(tokens), max_tokens):
-            chunk_tokens = tokens[i:i + max_tokens]
-            chunk_text = enc.decode(chunk_tokens)
-            chunks.append(chunk_text)
+    Returns:
+        list: List of text chunks
+    """
+    return list(iter_chunks(text, max_tokens))
+
+def sample_text(text, window=4000, samples=3, max_chars=20000):
+    """
+    Take a strided sample of text for metadata generation
+    
+    Instead of only the beginning (often title page, copyright and table of
+    contents), windows are taken from evenly spaced positions across the text.
+    
+    Args:
+        text (str): Full extracted text
+        window (int): Characters taken at each position
+        samples (int): Number of positions to sample
+        max_chars (int): Maximum length of the sample
         
-        return chunks
+    Returns:
+        str: The sampled text (the whole text if it is short enough)
+    """
+    if len(text) <= window * samples:
+        return text[:max_chars]
     
-    except Exception as e:
-        logger.error(f"Error chunking text: {e}")
-        # Fallback to simple character-based chunking if tokenization fails
-        return [text[i:i + 2000] for i in range(0, len(text), 2000)]
+    starts = [len(text) * k // samples for k in range(samples)]
+    return "\n...\n".join(text[start:start + window] for start in starts)[:max_chars]
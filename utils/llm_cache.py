@@ -0,0 +1,135 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Exact-match cache for model responses. Metadata and chat answers are a function of
+# the prompt for a fixed model/temperature, so re-ingesting a file or repeating a
+# question can be answered without another API call.
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1024))
+# Directory for a persistent cache shared between processes (requires diskcache)
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "/tmp/llm_cache")
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+class MemoryCache:
+    """
+    Thread-safe in-memory LRU cache with per-entry expiry
+    
+    Used when diskcache is not installed; offers the get/set/delete subset of
+    diskcache.Cache that this module needs.
+    """
+    
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key, value, expire=None):
+        with self.lock:
+            expires_at = time.monotonic() + expire if expire else None
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+    
+    def delete(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+
+def _create_cache():
+    """Use a persistent diskcache.Cache when available, otherwise memory"""
+    if diskcache is not None:
+        try:
+            return diskcache.Cache(LLM_CACHE_DIR)
+        except Exception as e:
+            logger.warning(f"Could not open LLM cache at {LLM_CACHE_DIR}, using memory: {e}")
+    return MemoryCache()
+
+
+cache = _create_cache()
+
+# One lock per key being computed, so concurrent identical requests make one API call
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def make_key(model, temperature, messages):
+    """
+    Build the cache key for a chat completion request
+    
+    Args:
+        model (str): Model name
+        temperature (float): Sampling temperature
+        messages (list): Chat messages (system prompt, user content, ...)
+    
+    Returns:
+        str: SHA-256 hex digest of the request
+    """
+    parts = [model, str(temperature)] + [message["content"] for message in messages]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_or_set(key, func, expire=LLM_CACHE_TTL, cacheable=None):
+    """
+    Return the cached value for key, computing and storing it with func on a miss
+    
+    Args:
+        key (str): Cache key (see make_key)
+        func (callable): Function producing the value; its exceptions propagate
+        expire (int): Seconds before the entry expires
+        cacheable (callable): Optional check on a newly computed value; values it
+            returns False for are returned without being stored
+    
+    Returns:
+        The cached or newly computed value
+    """
+    value = cache.get(key)
+    if value is not None:
+        logger.debug(f"LLM cache hit for {key[:12]}")
+        return value
+    
+    with _key_locks_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    
+    try:
+        with key_lock:
+            # Another thread may have filled the entry while we waited
+            value = cache.get(key)
+            if value is None:
+                value = func()
+                if value is not None and (cacheable is None or cacheable(value)):
+                    cache.set(key, value, expire=expire)
+            return value
+    finally:
+        with _key_locks_lock:
+            if _key_locks.get(key) is key_lock and not key_lock.locked():
+                del _key_locks[key]
+
+
+def delete(key):
+    """Remove an entry, e.g. when the cached response turned out to be unusable"""
+    cache.delete(key)
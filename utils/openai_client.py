@@ -0,0 +1,115 @@
+import os
+import ssl
+import atexit
+import asyncio
+import logging
+import threading
+import weakref
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Connection pool shared by all OpenAI requests. Keeping one client alive for the
+# life of the process reuses TCP/TLS connections instead of handshaking per request.
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 128))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 64))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 60))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+# Non-streaming chat completions only start responding once generation has finished,
+# so a large metadata batch can take minutes; they get the SDK's own default instead
+OPENAI_GENERATION_TIMEOUT = float(os.environ.get("OPENAI_GENERATION_TIMEOUT", 600))
+
+# Building an SSL context loads the CA bundle from disk; do it once and share it
+# between the sync pool and every async client
+shared_ssl_context = ssl.create_default_context()
+
+_http_client = None
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {api_key: AsyncOpenAI}
+_lock = threading.Lock()
+
+
+def _pool_options():
+    """Connection limits, timeouts and SSL context shared by the sync and async pools"""
+    return {
+        "limits": httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        ),
+        "timeout": httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        "verify": shared_ssl_context,
+    }
+
+
+def _pooled_client(client_class):
+    """Create an httpx client with the shared pool options, using HTTP/2 when the h2 package is installed"""
+    try:
+        return client_class(http2=True, **_pool_options())
+    except ImportError:
+        logger.info("h2 not installed, using HTTP/1.1 for OpenAI requests")
+        return client_class(**_pool_options())
+
+
+def _create_http_client():
+    """Create the pooled HTTP client shared by all sync OpenAI clients"""
+    http_client = _pooled_client(httpx.Client)
+    
+    # Close pooled connections cleanly when the process exits
+    atexit.register(http_client.close)
+    return http_client
+
+
+def get_client(api_key=None):
+    """
+    Get the shared OpenAI client for an API key
+    
+    Clients are created once and never closed, so embedding and chat calls
+    from every module share the same connection pool.
+    
+    Args:
+        api_key (str): OpenAI API key (defaults to OPENAI_API_KEY from the environment)
+    
+    Returns:
+        OpenAI: Shared client, or None if no API key is available
+    """
+    global _http_client
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            if _http_client is None:
+                _http_client = _create_http_client()
+            client = OpenAI(api_key=api_key, http_client=_http_client)
+            _clients[api_key] = client
+        return client
+
+
+def get_async_client(api_key=None):
+    """
+    Get the AsyncOpenAI client for the running event loop
+    
+    Async connections belong to the loop that opened them, so one client is
+    kept per event loop (and dropped together with it).
+    
+    Args:
+        api_key (str): OpenAI API key (defaults to OPENAI_API_KEY from the environment)
+    
+    Returns:
+        AsyncOpenAI: Client for the current loop, or None if no API key is available
+    """
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    
+    loop_clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key, http_client=_pooled_client(httpx.AsyncClient))
+        loop_clients[api_key] = client
+    return client
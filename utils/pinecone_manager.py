@@ -3,15 +3,109 @@ import time
 import os
 import json
 from pinecone import Pinecone, ServerlessSpec
+from utils.rate_limit import retry_with_backoff
 
 logger = logging.getLogger(__name__)
 
+# The gRPC client (pinecone[grpc] extra) uses HTTP/2 + protobuf and is notably faster
+# for upserts than REST. Fall back to REST when the extra isn't installed.
+PINECONE_USE_GRPC = os.environ.get("PINECONE_USE_GRPC", "true").lower() == "true"
+try:
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
+
+# orjson sizes upsert payloads faster than the stdlib; fall back if it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Limits for a single Pinecone upsert request; Pinecone rejects payloads over 2 MB,
+# so the byte budget leaves headroom for request overhead
+PINECONE_UPSERT_BATCH_VECTORS = int(os.environ.get("PINECONE_UPSERT_BATCH_VECTORS", 100))
+PINECONE_UPSERT_BATCH_BYTES = int(os.environ.get("PINECONE_UPSERT_BATCH_BYTES", 1_800_000))
+
+# Attempts for an upsert request that failed with a transient error (e.g. 429 or 5xx)
+PINECONE_UPSERT_RETRIES = int(os.environ.get("PINECONE_UPSERT_RETRIES", 3))
+
+# Transient upsert failures. The REST client reports the HTTP status on its exceptions,
+# the gRPC client a grpc.StatusCode; dropped connections and timeouts can come from
+# either, or from urllib3 underneath the REST client.
+PINECONE_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+try:
+    import grpc
+    PINECONE_RETRYABLE_GRPC_CODES = (
+        grpc.StatusCode.UNAVAILABLE,
+        grpc.StatusCode.RESOURCE_EXHAUSTED,
+        grpc.StatusCode.DEADLINE_EXCEEDED,
+    )
+except ImportError:
+    grpc = None
+    PINECONE_RETRYABLE_GRPC_CODES = ()
+try:
+    from urllib3.exceptions import ProtocolError, TimeoutError as Urllib3TimeoutError
+    PINECONE_TRANSPORT_ERRORS = (ConnectionError, TimeoutError, ProtocolError, Urllib3TimeoutError)
+except ImportError:
+    PINECONE_TRANSPORT_ERRORS = (ConnectionError, TimeoutError)
+
+
+def is_retryable_upsert_error(error):
+    """
+    Return True for upsert failures worth retrying
+    
+    The error and its causes are checked, since the gRPC futures wrap the
+    underlying grpc.RpcError in a PineconeException.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, PINECONE_TRANSPORT_ERRORS):
+            return True
+        if getattr(error, "status", None) in PINECONE_RETRYABLE_STATUS:
+            return True
+        if grpc is not None and isinstance(error, grpc.RpcError) and callable(getattr(error, "code", None)):
+            if error.code() in PINECONE_RETRYABLE_GRPC_CODES:
+                return True
+        error = error.__cause__ or error.__context__
+    return False
+
+# File-level metadata is stored once per document in this namespace instead of
+# being copied into every chunk; chunks reference it through their doc_id
+DOCUMENTS_NAMESPACE = "documents"
+
+def pack_vectors(vectors, max_vectors=PINECONE_UPSERT_BATCH_VECTORS, max_bytes=PINECONE_UPSERT_BATCH_BYTES):
+    """
+    Split vectors into upsert requests that fit Pinecone's payload limits
+    
+    Vectors are packed greedily in order; a request is closed when adding the
+    next vector would exceed max_bytes (measured as serialized JSON) or max_vectors.
+    
+    Args:
+        vectors (list): Pinecone vector dicts with id, values and metadata
+        max_vectors (int): Maximum vectors per request
+        max_bytes (int): Maximum serialized size per request
+        
+    Yields:
+        list: Vectors for one upsert request
+    """
+    packed, size = [], 0
+    for vector in vectors:
+        vector_size = len(orjson.dumps(vector)) if orjson is not None else len(json.dumps(vector))
+        if packed and (size + vector_size > max_bytes or len(packed) >= max_vectors):
+            yield packed
+            packed, size = [], 0
+        packed.append(vector)
+        size += vector_size
+    if packed:
+        yield packed
+
 class PineconeManager:
     """
     Manager class for Pinecone vector database operations
     """
     
-    def __init__(self, api_key, environment, index_name="docai", dimension=1536):
+    def __init__(self, api_key, environment, index_name="docai", dimension=1536, pool_threads=None):
         """
         Initialize Pinecone connection and index
         
@@ -20,6 +114,7 @@ class PineconeManager:
             environment (str): Pinecone environment
             index_name (str): Name of the Pinecone index
             dimension (int): Dimension of the vector embeddings
+            pool_threads (int): Threads used for async_req upserts (default PINECONE_POOL_THREADS or 30)
         """
         self.api_key = api_key
         self.environment = environment
@@ -33,7 +128,13 @@ class PineconeManager:
         
         try:
             # Initialize Pinecone client with the API key
-            self.pc = Pinecone(api_key=api_key)
+            if PINECONE_USE_GRPC and PineconeGRPC is not None:
+                self.pc = PineconeGRPC(api_key=api_key)
+                logger.info("Using Pinecone gRPC client")
+            else:
+                if PINECONE_USE_GRPC:
+                    logger.info("pinecone[grpc] not installed, using Pinecone REST client")
+                self.pc = Pinecone(api_key=api_key)
             
             # Get list of indexes
             existing_indexes = [idx.name for idx in self.pc.list_indexes().indexes]
@@ -49,9 +150,20 @@ class PineconeManager:
                 )
                 # Wait for index to be ready
                 time.sleep(5)  # Wait a bit longer for index creation
+            else:
+                # An existing index keeps its dimension, so embeddings of another size will be rejected
+                try:
+                    index_dimension = self.pc.describe_index(index_name).dimension
+                    if index_dimension != dimension:
+                        logger.warning(f"Pinecone index {index_name} has dimension {index_dimension} "
+                                       f"but embeddings use {dimension}; recreate the index to match")
+                except Exception as describe_error:
+                    logger.warning(f"Could not verify dimension of index {index_name}: {describe_error}")
             
-            # Connect to the index
-            self.index = self.pc.Index(index_name)
+            # Connect to the index with a thread pool for parallel async_req upserts
+            if pool_threads is None:
+                pool_threads = int(os.environ.get("PINECONE_POOL_THREADS", "30"))
+            self.index = self.pc.Index(index_name, pool_threads=pool_threads)
             logger.info(f"Connected to Pinecone index: {index_name}")
             
         except Exception as e:
@@ -67,6 +179,104 @@ class PineconeManager:
             vector (list): Vector embedding
             metadata (dict): Metadata to store with the vector
         
+        Returns:
+            bool: Success status
+        """
+        return self.upsert_many([(id, vector, metadata)]) == 1
+    
+    def upsert_many(self, items, namespace="default", batch_size=PINECONE_UPSERT_BATCH_VECTORS):
+        """
+        Upsert many vectors with as few requests as the payload limits allow
+        
+        Args:
+            items (iterable): (id, vector, metadata) tuples
+            namespace (str): Namespace to upsert into
+            batch_size (int): Maximum vectors per request
+        
+        Returns:
+            int: Number of vectors upserted; requests that fail are logged and skipped
+        """
+        if not self.index:
+            logger.error("Pinecone index not initialized")
+            return 0
+        
+        vectors = [{"id": id, "values": vector, "metadata": metadata or {}} for id, vector, metadata in items]
+        
+        # Submit every request to the index's thread pool first so they run
+        # concurrently (bounded by pool_threads), then collect the results
+        pending = []
+        for packed in pack_vectors(vectors, max_vectors=batch_size):
+            try:
+                pending.append((packed, self.index.upsert(vectors=packed, namespace=namespace, async_req=True)))
+            except Exception as e:
+                pending.append((packed, e))
+        
+        upserted = 0
+        for packed, upsert_result in pending:
+            try:
+                self.finish_upsert(packed, upsert_result, namespace=namespace)
+            except Exception as e:
+                logger.error(f"Error upserting {len(packed)} vectors to Pinecone: {e}")
+                continue
+            upserted += len(packed)
+        return upserted
+    
+    def finish_upsert(self, packed, upsert_result, namespace="default"):
+        """
+        Wait for an upsert submitted with async_req=True, retrying it if it failed transiently
+        
+        Args:
+            packed (list): Vectors the upsert was submitted with
+            upsert_result: Handle returned by index.upsert(..., async_req=True), or the
+                exception raised while submitting it
+            namespace (str): Namespace the upsert was submitted to
+        
+        Returns:
+            The upsert response; raises if the upsert failed
+        """
+        try:
+            if isinstance(upsert_result, Exception):
+                raise upsert_result
+            return self.wait_for_upsert(upsert_result)
+        except Exception as e:
+            if not is_retryable_upsert_error(e):
+                raise
+            # Transient failures such as rate limits are retried on their own with backoff
+            logger.warning(f"Upsert of {len(packed)} vectors failed, retrying: {e}")
+            return retry_with_backoff(
+                lambda: self.index.upsert(vectors=packed, namespace=namespace),
+                max_attempts=PINECONE_UPSERT_RETRIES,
+                limiter=None,
+                retry_on=(Exception,),
+                token_limiter=None,
+                should_retry=is_retryable_upsert_error
+            )
+    
+    @staticmethod
+    def wait_for_upsert(upsert_result):
+        """
+        Block until an upsert submitted with async_req=True has completed
+        
+        Args:
+            upsert_result: Handle returned by index.upsert(..., async_req=True)
+        
+        Returns:
+            The upsert response; raises if the upsert failed
+        """
+        # The gRPC client returns a concurrent.futures-style future, REST an ApplyResult
+        if hasattr(upsert_result, 'result'):
+            return upsert_result.result()
+        return upsert_result.get()
+    
+    def upsert_document(self, doc_id, metadata):
+        """
+        Store file-level metadata once in the documents namespace
+        
+        Args:
+            doc_id (str): Document identifier referenced by the chunks' doc_id; the
+                upload's doc_uuid, so files with the same name don't overwrite each other
+            metadata (dict): Metadata shared by all chunks of the document
+        
         Returns:
             bool: Success status
         """
@@ -75,24 +285,46 @@ class PineconeManager:
             return False
         
         try:
-            # Format for the latest Pinecone client
+            # Records need a vector; these are only fetched by id, so a fixed
+            # unit vector is enough (cosine indexes reject all-zero vectors)
+            placeholder = [1.0] + [0.0] * (self.dimension - 1)
             self.index.upsert(
-                vectors=[
-                    {
-                        "id": id,
-                        "values": vector,
-                        "metadata": metadata or {}
-                    }
-                ],
-                namespace="default"
+                vectors=[{"id": doc_id, "values": placeholder, "metadata": metadata or {}}],
+                namespace=DOCUMENTS_NAMESPACE
             )
             return True
         
         except Exception as e:
-            logger.error(f"Error upserting to Pinecone: {e}")
+            logger.error(f"Error storing document metadata in Pinecone: {e}")
             return False
     
-    def query(self, vector, top_k=5, include_metadata=True, filter_dict=None):
+    def fetch_documents(self, doc_ids):
+        """
+        Fetch file-level metadata stored with upsert_document
+        
+        Args:
+            doc_ids (iterable): Document identifiers
+        
+        Returns:
+            dict: Metadata by document id (missing documents are omitted)
+        """
+        doc_ids = list(doc_ids)
+        if not self.index or not doc_ids:
+            return {}
+        
+        try:
+            response = self.index.fetch(ids=doc_ids, namespace=DOCUMENTS_NAMESPACE)
+            vectors = response.vectors if hasattr(response, 'vectors') else response.get('vectors', {})
+            return {
+                doc_id: (record.metadata if hasattr(record, 'metadata') else record.get('metadata')) or {}
+                for doc_id, record in vectors.items()
+            }
+        
+        except Exception as e:
+            logger.error(f"Error fetching document metadata from Pinecone: {e}")
+            return {}
+    
+    def query(self, vector, top_k=5, include_metadata=True, filter_dict=None, resolve_documents=False):
         """
         Query Pinecone for similar vectors
         
@@ -101,6 +333,8 @@ class PineconeManager:
             top_k (int): Number of results to return
             include_metadata (bool): Whether to include metadata in results
             filter_dict (dict): Optional filter conditions
+            resolve_documents (bool): Merge each match's document-level metadata
+                (see upsert_document) into its chunk metadata
         
         Returns:
             dict: Query results
@@ -126,12 +360,28 @@ class PineconeManager:
             # Execute the query
             result = self.index.query(**query_params)
             
+            if resolve_documents and include_metadata:
+                result = self._resolve_documents(result)
+            
             return result
         
         except Exception as e:
             logger.error(f"Error querying Pinecone: {e}")
             return {"matches": []}
     
+    def _resolve_documents(self, result):
+        """Return query results with document-level metadata merged into each match"""
+        matches = [match.to_dict() if hasattr(match, 'to_dict') else dict(match)
+                   for match in result.get('matches', [])]
+        documents = self.fetch_documents({
+            match['metadata']['doc_id'] for match in matches
+            if match.get('metadata') and match['metadata'].get('doc_id')
+        })
+        for match in matches:
+            metadata = match.get('metadata') or {}
+            match['metadata'] = {**documents.get(metadata.get('doc_id'), {}), **metadata}
+        return {"matches": matches}
+    
     def delete(self, ids=None, delete_all=False, namespace="default"):
         """
         Delete vectors from Pinecone
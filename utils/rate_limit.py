@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import asyncio
+import random
+import logging
+import threading
+from openai import (
+    RateLimitError, APIConnectionError, APITimeoutError, InternalServerError,
+    AuthenticationError, PermissionDeniedError
+)
+
+logger = logging.getLogger(__name__)
+
+# Request budget shared by every OpenAI call in the process (embeddings and chat).
+# Set it to your account tier's requests-per-minute limit.
+OPENAI_MAX_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_MAX_REQUESTS_PER_MINUTE", 3500))
+# Token budget (input + requested output tokens) for chat requests; 0 disables it
+OPENAI_MAX_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_MAX_TOKENS_PER_MINUTE", 800000))
+OPENAI_RETRY_ATTEMPTS = int(os.environ.get("OPENAI_RETRY_ATTEMPTS", 5))
+OPENAI_RETRY_MAX_WAIT = float(os.environ.get("OPENAI_RETRY_MAX_WAIT", 30))
+
+# Transient failures worth retrying: 429s, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+# Failures that no amount of retrying will fix
+FATAL_ERRORS = (AuthenticationError, PermissionDeniedError)
+
+
+class Limiter:
+    """
+    Thread-safe token bucket
+    
+    The bucket holds up to `rate` tokens and refills continuously at `rate` tokens
+    per `period` seconds; each request takes one token, waiting if none are left.
+    """
+    
+    def __init__(self, rate, period=60.0):
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def _try_acquire(self, tokens):
+        """Take tokens if available; return 0 on success, otherwise the seconds to wait"""
+        with self.lock:
+            now = time.monotonic()
+            refill = (now - self.updated) * self.rate / self.period
+            self.tokens = min(self.rate, self.tokens + refill)
+            self.updated = now
+            
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            
+            return (tokens - self.tokens) * self.period / self.rate
+    
+    def acquire(self, tokens=1):
+        """
+        Take tokens from the bucket, blocking until enough are available
+        
+        Args:
+            tokens (int): Number of tokens to take (at most the bucket size)
+        """
+        tokens = min(tokens, self.rate)
+        while (wait_time := self._try_acquire(tokens)) > 0:
+            time.sleep(wait_time)
+    
+    async def acquire_async(self, tokens=1):
+        """Take tokens from the bucket, waiting without blocking the event loop"""
+        tokens = min(tokens, self.rate)
+        while (wait_time := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait_time)
+
+
+# Shared limiters for all OpenAI requests: one request per call, and the call's
+# estimated token count, so requests are spread out before the API starts returning 429s
+openai_limiter = Limiter(OPENAI_MAX_REQUESTS_PER_MINUTE)
+openai_token_limiter = Limiter(OPENAI_MAX_TOKENS_PER_MINUTE) if OPENAI_MAX_TOKENS_PER_MINUTE > 0 else None
+
+
+# x-ratelimit-reset-* durations look like "20ms", "1s" or "6m0s"
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value):
+    """Convert an OpenAI reset duration to seconds (0 if it can't be parsed)"""
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_RE.findall(value or ""))
+
+
+def _retry_after(error):
+    """
+    Read the server's retry hint (in seconds) from an error response, if present
+    
+    Uses Retry-After, falling back to the time until the exhausted request or token
+    budget resets (x-ratelimit-reset-requests / x-ratelimit-reset-tokens).
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return 0
+    try:
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            return float(retry_after)
+    except (TypeError, ValueError):
+        pass
+    
+    if headers.get("x-ratelimit-remaining-requests") == "0":
+        return _parse_duration(headers.get("x-ratelimit-reset-requests"))
+    if headers.get("x-ratelimit-remaining-tokens") == "0":
+        return _parse_duration(headers.get("x-ratelimit-reset-tokens"))
+    return 0
+
+
+def backoff_delay(error, attempt, base=1.0, max_wait=OPENAI_RETRY_MAX_WAIT):
+    """
+    Seconds to wait before retrying after an error
+    
+    Full-jitter exponential backoff (uniform up to base * 2**(attempt + 1), capped at max_wait),
+    so clients that failed together don't retry in lockstep; the server's retry hint
+    is used instead if it is longer.
+    
+    Args:
+        error (Exception): Error from the failed attempt
+        attempt (int): Number of failed attempts before this one (0 for the first)
+        base (float): Backoff base in seconds
+        max_wait (float): Upper bound for the jittered backoff in seconds
+    
+    Returns:
+        float: Seconds to sleep
+    """
+    return max(_retry_after(error), random.uniform(0, min(max_wait, base * 2 ** (attempt + 1))))
+
+
+def is_fatal_error(error):
+    """Return True for errors retrying can't fix, such as an invalid or missing API key"""
+    return isinstance(error, FATAL_ERRORS) or "API key" in str(error)
+
+
+def retry_with_backoff(func, *, max_attempts=OPENAI_RETRY_ATTEMPTS, base=1.0, limiter=openai_limiter,
+                       retry_on=RETRYABLE_ERRORS, max_wait=OPENAI_RETRY_MAX_WAIT,
+                       tokens=0, token_limiter=openai_token_limiter, should_retry=None):
+    """
+    Call an OpenAI API function under the rate limiter, retrying transient errors
+    
+    Rate limits, timeouts, connection errors and 5xx responses are retried. Between
+    attempts it sleeps for backoff_delay: the server's retry hint, or a jittered
+    exponential backoff capped at max_wait. Other errors are raised immediately so
+    the caller's own error handling applies.
+    
+    Args:
+        func (callable): Function performing the API request
+        max_attempts (int): Maximum number of attempts
+        base (float): Backoff base in seconds
+        limiter (Limiter): Limiter to acquire a token from before each attempt
+        retry_on (tuple): Exception types to retry
+        max_wait (float): Upper bound for a single backoff in seconds
+        tokens (int): Estimated tokens used by the request, taken from token_limiter
+        token_limiter (Limiter): Token-per-minute limiter
+        should_retry (callable): Optional check on a retry_on error; errors it
+            returns False for are raised immediately
+    
+    Returns:
+        The return value of func
+    """
+    for attempt in range(max_attempts):
+        if limiter is not None:
+            limiter.acquire()
+        if token_limiter is not None and tokens:
+            token_limiter.acquire(tokens)
+        try:
+            return func()
+        except retry_on as e:
+            if should_retry is not None and not should_retry(e):
+                raise
+            if attempt + 1 >= max_attempts:
+                logger.error(f"OpenAI request failed after {max_attempts} attempts: {e}")
+                raise
+            
+            wait_time = backoff_delay(e, attempt, base, max_wait)
+            logger.warning(f"{type(e).__name__} (attempt {attempt + 1}/{max_attempts}), waiting {wait_time:.1f}s")
+            time.sleep(wait_time)
+
+
+async def async_retry_with_backoff(func, *, max_attempts=OPENAI_RETRY_ATTEMPTS, base=1.0, limiter=openai_limiter,
+                                   retry_on=RETRYABLE_ERRORS, max_wait=OPENAI_RETRY_MAX_WAIT,
+                                   tokens=0, token_limiter=openai_token_limiter):
+    """
+    Async version of retry_with_backoff
+    
+    Args:
+        func (callable): Function returning an awaitable that performs the API request
+        max_attempts (int): Maximum number of attempts
+        base (float): Backoff base in seconds
+        limiter (Limiter): Limiter to acquire a token from before each attempt
+        retry_on (tuple): Exception types to retry
+        max_wait (float): Upper bound for a single backoff in seconds
+        tokens (int): Estimated tokens used by the request, taken from token_limiter
+        token_limiter (Limiter): Token-per-minute limiter
+    
+    Returns:
+        The result of the awaited request
+    """
+    for attempt in range(max_attempts):
+        if limiter is not None:
+            await limiter.acquire_async()
+        if token_limiter is not None and tokens:
+            await token_limiter.acquire_async(tokens)
+        try:
+            return await func()
+        except retry_on as e:
+            if attempt + 1 >= max_attempts:
+                logger.error(f"OpenAI request failed after {max_attempts} attempts: {e}")
+                raise
+            
+            wait_time = backoff_delay(e, attempt, base, max_wait)
+            logger.warning(f"{type(e).__name__} (attempt {attempt + 1}/{max_attempts}), waiting {wait_time:.1f}s")
+            await asyncio.sleep(wait_time)
@@ -0,0 +1,221 @@
+import os
+import math
+import time
+import zlib
+import logging
+import threading
+from collections import deque, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cache of chat answers keyed by query embedding and retrieved context: a new question
+# whose embedding is close enough to an earlier one, and that retrieved the same chunks,
+# gets that answer without a model call. ada-002 similarities cluster between 0.7 and 1.0,
+# so the threshold has to be high to only match paraphrases.
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.98))
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", 24 * 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+
+# Near-duplicate text detection (NearDuplicateCache): MinHash signatures over character
+# shingles, bucketed with LSH so a lookup only compares a few candidate texts. 16 bands
+# of 8 rows make pairs below ~0.7 Jaccard similarity unlikely to become candidates.
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16
+_MINHASH_PRIME = 4294967291  # Largest prime below 2**32, so products fit in 64 bits
+
+# numpy makes the similarity scan a single matrix-vector product; fall back to pure
+# Python if it isn't installed. NearDuplicateCache requires it.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _normalize(embedding):
+    """Scale an embedding to unit length so a dot product is its cosine similarity"""
+    if np is not None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    norm = math.sqrt(sum(value * value for value in embedding))
+    return [value / norm for value in embedding] if norm else list(embedding)
+
+
+class SemanticCache:
+    """
+    Thread-safe nearest-neighbour cache of responses by embedding
+    
+    Entries expire after `ttl` seconds; when full, the oldest entry is dropped.
+    Each entry also carries a context key (e.g. the ids of the retrieved chunks),
+    and only entries with the same context key can match.
+    """
+    
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL, max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.entries = deque(maxlen=max_entries)  # (created, unit vector, context, response), oldest first
+        self.lock = threading.Lock()
+    
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self.entries and self.entries[0][0] < cutoff:
+            self.entries.popleft()
+    
+    def lookup(self, embedding, context=None):
+        """
+        Find the cached response for the most similar earlier embedding
+        
+        Args:
+            embedding (list): Query embedding
+            context (hashable): Context key the response must have been stored with
+        
+        Returns:
+            dict: Copy of the cached response, or None if no entry reaches the threshold
+        """
+        query = _normalize(embedding)
+        with self.lock:
+            self._expire()
+            candidates = [entry for entry in self.entries if entry[2] == context]
+            if not candidates:
+                return None
+            
+            if np is not None:
+                similarities = np.stack([vector for _, vector, _, _ in candidates]) @ query
+                best = int(np.argmax(similarities))
+                best_similarity = float(similarities[best])
+            else:
+                best, best_similarity = -1, -1.0
+                for index, (_, vector, _, _) in enumerate(candidates):
+                    similarity = sum(a * b for a, b in zip(vector, query))
+                    if similarity > best_similarity:
+                        best, best_similarity = index, similarity
+            
+            if best_similarity < self.threshold:
+                return None
+            
+            logger.debug(f"Semantic cache hit (similarity {best_similarity:.3f})")
+            return dict(candidates[best][3])
+    
+    def add(self, embedding, response, context=None):
+        """
+        Store a response under its query embedding
+        
+        Args:
+            embedding (list): Query embedding
+            response (dict): Response to return for similar queries
+            context (hashable): Context key the response was generated from
+        """
+        with self.lock:
+            self.entries.append((time.monotonic(), _normalize(embedding), context, dict(response)))
+
+
+
+class NearDuplicateCache:
+    """
+    Thread-safe LRU cache of values by text that also matches nearly identical texts
+    
+    A lookup returns the value stored for the most similar cached text whose Jaccard
+    similarity over SHINGLE_SIZE-character shingles reaches the threshold. Candidates
+    come from MinHash LSH buckets; the similarity is then computed exactly.
+    """
+    
+    def __init__(self, threshold=0.95, max_entries=2048, seed=1):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+        self.b = rng.integers(0, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+        self.entries = OrderedDict()  # id -> (shingle hashes, band keys, value), least recent first
+        self.buckets = {}  # band key -> set of entry ids
+        self.next_id = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _shingles(text):
+        """Sorted unique 32-bit hashes of the text's character shingles"""
+        encoded = text.encode("utf-8", errors="surrogatepass")
+        count = max(1, len(encoded) - SHINGLE_SIZE + 1)
+        hashes = np.fromiter(
+            (zlib.crc32(encoded[i:i + SHINGLE_SIZE]) for i in range(count)),
+            dtype=np.uint32, count=count
+        )
+        return np.unique(hashes)
+    
+    def _band_keys(self, hashes):
+        """LSH bucket keys for a text's MinHash signature, one per band"""
+        products = hashes.astype(np.uint64)[:, None] * self.a % _MINHASH_PRIME
+        signature = ((products + self.b) % _MINHASH_PRIME).min(axis=0)
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(MINHASH_BANDS)]
+    
+    def sketch(self, text):
+        """
+        Shingle hashes and LSH band keys for a text
+        
+        A miss is usually followed by a set for the same text, so callers can
+        compute this once and pass it to both.
+        """
+        hashes = self._shingles(text)
+        return hashes, self._band_keys(hashes)
+    
+    def get(self, text, sketch=None):
+        """
+        Find the value stored for the most similar cached text
+        
+        Args:
+            text (str): Text to look up
+            sketch (tuple): The text's sketch, if already computed
+        
+        Returns:
+            The cached value, or None if no text reaches the threshold
+        """
+        hashes, band_keys = sketch or self.sketch(text)
+        with self.lock:
+            candidates = set().union(*(self.buckets.get(key, ()) for key in band_keys))
+            best, best_similarity = None, 0.0
+            for entry_id in candidates:
+                other = self.entries[entry_id][0]
+                shared = np.intersect1d(hashes, other, assume_unique=True).size
+                similarity = shared / (hashes.size + other.size - shared)
+                if similarity > best_similarity:
+                    best, best_similarity = entry_id, similarity
+            
+            if best is None or best_similarity < self.threshold:
+                return None
+            
+            logger.debug(f"Near-duplicate cache hit (Jaccard {best_similarity:.3f})")
+            self.entries.move_to_end(best)
+            return self.entries[best][2]
+    
+    def set(self, text, value, sketch=None):
+        """
+        Store a value under a text
+        
+        Args:
+            text (str): Text the value belongs to
+            value: Value to return for this text and near duplicates of it
+            sketch (tuple): The text's sketch, if already computed
+        """
+        hashes, band_keys = sketch or self.sketch(text)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (hashes, band_keys, value)
+            for key in band_keys:
+                self.buckets.setdefault(key, set()).add(entry_id)
+            
+            while len(self.entries) > self.max_entries:
+                old_id, (_, old_keys, _) = self.entries.popitem(last=False)
+                for key in old_keys:
+                    bucket = self.buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(old_id)
+                        if not bucket:
+                            del self.buckets[key]
+
+
+# Shared cache for chat answers
+chat_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None